@@ -0,0 +1,270 @@
+"""
+无界面批量渲染：把GitHub仓库或本地目录中的文本预先合成为有声书
+
+示例:
+    python batch_render.py https://github.com/Mestas/Books --out audiobooks
+    python batch_render.py ./books --engine edge_tts --files 4 --workers 8
+
+与界面共用缓存目录，夜间预热后白天播放可直接命中缓存。
+"""
+import argparse
+import concurrent.futures
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional
+
+from tts_core import (
+    AudioEncoder, AudioMerger, CacheManager, EventBus, GitHubReader, Metrics, MultiEngineTTS,
+    SynthesisScheduler, TextProcessor
+)
+
+# ==================== 文件来源 ====================
+def list_local_files(root: str) -> List[Dict]:
+    """递归列出本地目录中的txt文件，格式与GitHubReader.get_files一致"""
+    files = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith('.'))
+        for filename in sorted(filenames):
+            if filename.endswith('.txt'):
+                full_path = os.path.join(dirpath, filename)
+                files.append({
+                    'name': filename,
+                    'path': os.path.relpath(full_path, root).replace(os.sep, '/'),
+                    'local_path': full_path,
+                    'size': os.path.getsize(full_path),
+                    'sha': None,
+                })
+    return files
+
+def read_source(file: Dict, github_reader: Optional[GitHubReader]) -> Optional[str]:
+    """读取本地或GitHub文件内容"""
+    if 'local_path' in file:
+        with open(file['local_path'], 'rb') as f:
+            return TextProcessor.decode_bytes(f.read())
+    return github_reader.read_file(file)
+
+# ==================== 批量渲染 ====================
+class BatchRenderer:
+    """批量渲染器：文件级并行，共享一个TTS系统，因此并发和速率预算是全局的"""
+
+    MANIFEST_NAME = 'manifest.json'
+
+    def __init__(self, tts_system: MultiEngineTTS, out_dir: str, engine: str,
+                 chunk_size: int = 400, lang: str = 'zh-cn', workers: int = 4):
+        self.tts_system = tts_system
+        self.out_dir = out_dir
+        self.engine = engine
+        self.chunk_size = chunk_size
+        self.lang = lang
+        self.workers = workers
+        self.manifest_path = os.path.join(out_dir, self.MANIFEST_NAME)
+        self._lock = threading.Lock()
+        os.makedirs(out_dir, exist_ok=True)
+        self.manifest = self._load_manifest()
+
+    def _load_manifest(self) -> Dict:
+        if os.path.exists(self.manifest_path):
+            try:
+                with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except Exception as e:
+                print(f"清单读取失败，重新生成: {e}")
+        return {'files': {}}
+
+    def _save_manifest(self):
+        """原子写入清单"""
+        with self._lock:
+            self.manifest['updated'] = time.time()
+            data = json.dumps(self.manifest, ensure_ascii=False, indent=2)
+        with open(self.manifest_path + '.part', 'w', encoding='utf-8') as f:
+            f.write(data)
+        os.replace(self.manifest_path + '.part', self.manifest_path)
+
+    def _settings(self) -> Dict:
+        """影响输出音频的设置，任一变化都需要重新渲染"""
+        encoder = self.tts_system.cache_manager.encoder
+        return {
+            'engine': self.engine,
+            'chunk_size': self.chunk_size,
+            'lang': self.lang,
+            'format': encoder.name,
+            'bitrate': encoder.bitrate_kbps if encoder.transcodes else None,
+        }
+
+    def _up_to_date(self, file: Dict, text_hash: Optional[str] = None) -> bool:
+        """输出文件存在且来源和设置都没有变化"""
+        with self._lock:
+            entry = self.manifest['files'].get(file['path'])
+        if not entry or entry.get('status') != 'done' or entry.get('settings') != self._settings():
+            return False
+        if not os.path.exists(os.path.join(self.out_dir, entry['audio'])):
+            return False
+        if text_hash is not None:
+            return entry.get('text_hash') == text_hash
+        # GitHub文件用blob SHA判断，无需下载
+        return bool(file.get('sha')) and entry.get('source_sha') == file['sha']
+
+    def _synthesize(self, chunks: List[str], work_dir: str):
+        """合成所有分块，完成的块随即固定到工作目录，合并前不会被缓存淘汰
+
+        音频在固定前已被淘汰的块重新合成一次。返回 (按块顺序的音频路径（失败为None）, 各引擎服务的块数)。
+        """
+        results: List[Optional[str]] = [None] * len(chunks)
+        usage: Dict[str, int] = {}
+        todo = list(range(len(chunks)))
+        for _ in range(2):
+            lost = []
+            scheduler = SynthesisScheduler(self.tts_system, max_workers=self.workers)
+            completed = scheduler.iter_completed([chunks[i] for i in todo], self.engine, self.lang, True)
+            temp_files = set()
+            try:
+                for k, audio_path in completed:
+                    if not audio_path:
+                        continue
+                    if not self.tts_system.cache_manager.owns(audio_path):
+                        temp_files.add(audio_path)
+                    kept = os.path.join(work_dir, f"{todo[k]}{AudioEncoder.suffix_of(audio_path)}")
+                    if AudioMerger.keep(audio_path, kept):
+                        results[todo[k]] = kept
+                        used_engine = scheduler.chunk_engines.get(k)
+                        if used_engine:
+                            usage[used_engine] = usage.get(used_engine, 0) + 1
+                    else:
+                        lost.append(todo[k])
+            finally:
+                completed.close()
+                # 缓存写入失败时返回的是引擎临时文件，已复制到工作目录
+                for path in temp_files:
+                    if os.path.exists(path):
+                        os.remove(path)
+            if not lost:
+                break
+            todo = lost
+        return results, usage
+
+    def render_file(self, file: Dict, github_reader: Optional[GitHubReader]) -> str:
+        """渲染单个文件，返回状态: skipped / done / failed"""
+        if file.get('sha') and self._up_to_date(file):
+            return 'skipped'
+
+        text = read_source(file, github_reader)
+        if not text:
+            return 'failed'
+        text_hash = TextProcessor.content_hash(text)
+        if self._up_to_date(file, text_hash):
+            return 'skipped'
+
+        started = time.time()
+        chunks = TextProcessor.smart_chunk(text, self.chunk_size)
+        with tempfile.TemporaryDirectory(prefix='tts-batch-') as work_dir:
+            results, engines = self._synthesize(chunks, work_dir)
+
+            entry = {
+                'source_sha': file.get('sha'),
+                'text_hash': text_hash,
+                'settings': self._settings(),
+                'chunks': len(chunks),
+                'failed_chunks': [i for i, path in enumerate(results) if not path],
+                'engines': engines,
+                'rendered_at': time.time(),
+                'seconds': round(time.time() - started, 1),
+            }
+
+            if chunks and not entry['failed_chunks']:
+                encoder = self.tts_system.cache_manager.encoder
+                merged_path = AudioMerger.merge(results, encoder=encoder)
+                audio_name = os.path.splitext(file['path'])[0] + os.path.splitext(merged_path)[1]
+                target = os.path.join(self.out_dir, audio_name)
+                os.makedirs(os.path.dirname(target) or '.', exist_ok=True)
+                shutil.move(merged_path, target)
+                entry.update(status='done', audio=audio_name, size=os.path.getsize(target))
+            else:
+                entry.update(status='failed', audio=None)
+
+        with self._lock:
+            self.manifest['files'][file['path']] = entry
+        self._save_manifest()
+        return entry['status']
+
+    def render_all(self, files: List[Dict], github_reader: Optional[GitHubReader],
+                   parallel_files: int = 2) -> Dict[str, int]:
+        """并行渲染所有文件，返回各状态的文件数"""
+        summary = {'done': 0, 'skipped': 0, 'failed': 0}
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=max(1, parallel_files),
+                thread_name_prefix='tts-batch') as executor:
+            futures = {
+                executor.submit(self.render_file, file, github_reader): file
+                for file in files
+            }
+            for done, future in enumerate(concurrent.futures.as_completed(futures), 1):
+                file = futures[future]
+                try:
+                    status = future.result()
+                except Exception as e:
+                    print(f"渲染失败 {file['path']}: {e}")
+                    status = 'failed'
+                summary[status] += 1
+                print(f"[{done}/{len(files)}] {status:7s} {file['path']}")
+        return summary
+
+# ==================== 命令行入口 ====================
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="批量把GitHub仓库或本地目录中的文本渲染为有声书")
+    parser.add_argument('source', help="GitHub仓库URL（可含子目录）或本地目录")
+    parser.add_argument('--out', default='audiobooks', help="输出目录（含manifest.json）")
+    parser.add_argument('--engine', default='gTTS', help="首选TTS引擎")
+    parser.add_argument('--lang', default='zh-cn', help="语言")
+    parser.add_argument('--chunk-size', type=int, default=400, help="分块大小（字符）")
+    parser.add_argument('--files', type=int, default=2, help="同时处理的文件数")
+    parser.add_argument('--workers', type=int, default=4, help="每个文件的分块并发数")
+    parser.add_argument('--max-concurrency', type=int, help="引擎全局并发上限（覆盖默认值）")
+    parser.add_argument('--rate', type=float, help="引擎全局请求速率（次/秒，覆盖默认值）")
+    parser.add_argument('--cache-dir', default='.tts_cache', help="TTS缓存目录（与界面共用）")
+    parser.add_argument('--cache-mb', type=int, default=1000, help="缓存上限（MB）")
+    parser.add_argument('--format', default='mp3', choices=list(AudioEncoder.FORMATS), help="输出格式")
+    parser.add_argument('--bitrate', type=int, default=32, help="Opus/AAC码率（kbps）")
+    parser.add_argument('--metrics', help="结束时把各阶段耗时和计数（JSON）写入该文件")
+    return parser.parse_args(argv)
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+
+    # 只输出警告和错误，忽略缓存命中等提示
+    events = EventBus()
+    events.subscribe(lambda level, message: level != 'info' and print(f"[{level}] {message}"))
+
+    encoder = AudioEncoder(args.format, args.bitrate)
+    tts_system = MultiEngineTTS(CacheManager(args.cache_dir, args.cache_mb, encoder, events))
+    if args.engine not in tts_system.engines:
+        print(f"引擎 {args.engine} 不可用，可用引擎: {', '.join(tts_system.engines) or '无'}")
+        return 2
+    tts_system.set_budget(args.engine, max_concurrency=args.max_concurrency, rate=args.rate)
+
+    if os.path.isdir(args.source):
+        github_reader = None
+        files = list_local_files(args.source)
+    else:
+        github_reader = GitHubReader(events=events)
+        files = github_reader.get_files(args.source)
+    if not files:
+        print("未找到txt文件")
+        return 1
+
+    renderer = BatchRenderer(tts_system, args.out, args.engine, args.chunk_size,
+                             args.lang, args.workers)
+    summary = renderer.render_all(files, github_reader, args.files)
+    tts_system.cache_manager.flush()
+    print(f"完成 {summary['done']}，跳过 {summary['skipped']}，失败 {summary['failed']}")
+    if args.metrics:
+        with open(args.metrics, 'w', encoding='utf-8') as f:
+            json.dump(Metrics.shared().snapshot(), f, ensure_ascii=False, indent=2)
+    return 1 if summary['failed'] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
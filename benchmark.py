@@ -0,0 +1,305 @@
+"""
+离线基准测试：用确定性假引擎测量合成流水线各环节的吞吐和延迟
+
+示例:
+    python benchmark.py
+    python benchmark.py --cases chunk,merge --sizes-mb 1,4 --json bench.json
+
+不联网、不需要ffmpeg，音频全部由假引擎（TTS_FAKE_ENGINE）生成，结果可在提交之间对比。
+峰值内存为进程级峰值（只增不减），需要单项数据时用 --cases 单独运行。
+"""
+import argparse
+import concurrent.futures
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional
+
+from tts_core import (
+    AudioMerger, CacheManager, EngineBudgets, EventBus, FakeTTSEngine, Metrics, MultiEngineTTS,
+    SynthesisScheduler, TextProcessor
+)
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+SAMPLE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'zengguofan2.txt')
+CASES = ('chunk', 'cache', 'failover', 'rate_limit', 'merge', 'pipeline')
+
+# ==================== 测量工具 ====================
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """最近秩百分位数"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[rank]
+
+def peak_rss_mb() -> Optional[float]:
+    """进程峰值常驻内存（MB）"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux单位为KB，macOS为字节
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+def timed_map(fn: Callable, items: List, workers: int = 1):
+    """并发执行fn，返回 (结果列表, 每项耗时列表, 总耗时)"""
+    def run(item):
+        started = time.perf_counter()
+        result = fn(item)
+        return result, time.perf_counter() - started
+
+    started = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        outcomes = list(executor.map(run, items))
+    return [r for r, _ in outcomes], [t for _, t in outcomes], time.perf_counter() - started
+
+def record(case: str, items: int, seconds: float, latencies: List[float], **extra) -> Dict:
+    """一条基准结果：吞吐（项/秒）、p50/p99延迟（毫秒）和峰值内存"""
+    p50, p99 = percentile(latencies, 50), percentile(latencies, 99)
+    rss = peak_rss_mb()
+    return {
+        'case': case,
+        'items': items,
+        'seconds': round(seconds, 4),
+        'per_sec': round(items / seconds, 2) if seconds > 0 else None,
+        'p50_ms': round(p50 * 1000, 3) if p50 is not None else None,
+        'p99_ms': round(p99 * 1000, 3) if p99 is not None else None,
+        'peak_rss_mb': round(rss, 1) if rss is not None else None,
+        **extra,
+    }
+
+# ==================== 测试数据 ====================
+def sample_text() -> str:
+    with open(SAMPLE_FILE, 'rb') as f:
+        return TextProcessor.decode_bytes(f.read())
+
+def synthetic_text(size_mb: float, seed: int = 0) -> str:
+    """按固定种子生成指定大小（UTF-8字节）的中文文本，句长和段落随机"""
+    rng = random.Random(seed)
+    alphabet = [chr(c) for c in range(0x4E00, 0x4E00 + 3000)]
+    target = int(size_mb * 1024 * 1024)
+    parts, size = [], 0
+    while size < target:
+        sentence = ''.join(rng.choices(alphabet, k=rng.randint(4, 60))) + rng.choice('，。！？；')
+        if rng.random() < 0.05:
+            sentence += '\n\n'
+        parts.append(sentence)
+        size += len(sentence.encode('utf-8'))
+    return ''.join(parts)
+
+def make_tts(spec: str, cache_dir: str) -> MultiEngineTTS:
+    """只启用假引擎的TTS系统（TTS_FAKE_ENGINE / TTS_ENGINES 仅在构造期间生效）
+
+    引擎预算按名称在进程内共享，每个项目先清除同名引擎的预算，按本项目的配置重建。
+    """
+    names = [name for name, _ in FakeTTSEngine.parse_specs(spec)]
+    EngineBudgets.reset(names)
+    saved = {key: os.environ.get(key) for key in ('TTS_FAKE_ENGINE', 'TTS_ENGINES')}
+    os.environ['TTS_FAKE_ENGINE'] = spec
+    os.environ['TTS_ENGINES'] = ','.join(names)
+    try:
+        return MultiEngineTTS(CacheManager(cache_dir, 10000, events=EventBus()))
+    finally:
+        for key, value in saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+# ==================== 基准项目 ====================
+class Benchmarks:
+    """各基准项目，每个方法返回若干条结果"""
+
+    def __init__(self, work_dir: str, chunk_size: int = 400, workers: int = 8,
+                 repeat: int = 5, sizes_mb: List[float] = (1, 4)):
+        self.work_dir = work_dir
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.repeat = max(1, repeat)
+        self.sizes_mb = list(sizes_mb)
+        self.chunks = TextProcessor.smart_chunk(sample_text(), chunk_size)
+
+    def _cache_dir(self, name: str) -> str:
+        path = os.path.join(self.work_dir, f'cache_{name}')
+        shutil.rmtree(path, ignore_errors=True)
+        return path
+
+    def chunk(self) -> List[Dict]:
+        """smart_chunk冷路径：样本文件和多MB合成文本，延迟为单次完整分块耗时"""
+        texts = [('zengguofan2.txt', sample_text())]
+        texts += [(f'synthetic_{size:g}MB', synthetic_text(size)) for size in self.sizes_mb]
+        results = []
+        for name, text in texts:
+            timings, count = [], 0
+            for _ in range(self.repeat):
+                # 清空分块记忆，每次都完整扫描
+                TextProcessor._memo.clear()
+                started = time.perf_counter()
+                count = len(TextProcessor.smart_chunk(text, self.chunk_size))
+                timings.append(time.perf_counter() - started)
+            results.append(record(
+                f'chunk/{name}', count * self.repeat, sum(timings), timings,
+                chars=len(text), chunks=count
+            ))
+        return results
+
+    def cache(self) -> List[Dict]:
+        """缓存未命中（零延迟假引擎，测缓存写入开销）与命中路径"""
+        tts = make_tts('fake:latency=0', self._cache_dir('cache'))
+        results = []
+        for case in ('cache/miss', 'cache/hit'):
+            paths, latencies, elapsed = timed_map(
+                lambda chunk: tts.text_to_speech(chunk, 'fake'), self.chunks, self.workers
+            )
+            results.append(record(case, len(self.chunks), elapsed, latencies,
+                                  failed=paths.count(None),
+                                  engine_calls=tts.fake_engines['fake'].calls))
+        tts.cache_manager.flush()
+        return results
+
+    def failover(self) -> List[Dict]:
+        """首选引擎30%失败，观察熔断和切换到备用引擎的开销"""
+        tts = make_tts('fake:latency=0.01,failure_rate=0.3;fake_backup:latency=0.01',
+                       self._cache_dir('failover'))
+        outcomes, latencies, elapsed = timed_map(
+            lambda chunk: tts.synthesize(chunk, 'fake', use_cache=False), self.chunks, self.workers
+        )
+        usage: Dict[str, int] = {}
+        for path, engine in outcomes:
+            if path:
+                os.remove(path)
+                usage[engine] = usage.get(engine, 0) + 1
+        return [record('failover', len(self.chunks), elapsed, latencies,
+                       failed=len(self.chunks) - sum(usage.values()), engines=usage,
+                       breaker=tts.breakers['fake'].state)]
+
+    def rate_limit(self) -> List[Dict]:
+        """令牌桶限速为50次/秒且10%请求返回429，测实际吞吐和降速后的速率"""
+        tts = make_tts('fake:latency=0.005,throttle_rate=0.1,rate=50', self._cache_dir('rate_limit'))
+        paths, latencies, elapsed = timed_map(
+            lambda chunk: tts.text_to_speech(chunk, 'fake', use_cache=False), self.chunks, self.workers
+        )
+        for path in paths:
+            if path:
+                os.remove(path)
+        return [record('rate_limit', len(self.chunks), elapsed, latencies,
+                       failed=paths.count(None), final_rate=round(tts._limiters['fake'].rate, 2))]
+
+    def merge(self) -> List[Dict]:
+        """MP3逐帧拼接，延迟为单次合并耗时"""
+        fake = FakeTTSEngine()
+        chunk_dir = os.path.join(self.work_dir, 'merge_chunks')
+        os.makedirs(chunk_dir, exist_ok=True)
+        files = []
+        for i, chunk in enumerate(self.chunks):
+            path = os.path.join(chunk_dir, f'{i:05d}.mp3')
+            with open(path, 'wb') as f:
+                f.write(fake.audio_bytes(chunk))
+            files.append(path)
+
+        timings, size = [], 0
+        for _ in range(self.repeat):
+            started = time.perf_counter()
+            merged = AudioMerger.merge(files)
+            timings.append(time.perf_counter() - started)
+            size = os.path.getsize(merged)
+            os.remove(merged)
+        shutil.rmtree(chunk_dir, ignore_errors=True)
+        return [record('merge', len(files) * self.repeat, sum(timings), timings,
+                       output_mb=round(size / 1024 / 1024, 2),
+                       mb_per_sec=round(size * self.repeat / 1024 / 1024 / sum(timings), 1))]
+
+    def pipeline(self) -> List[Dict]:
+        """端到端：分块、调度器并发合成（50毫秒延迟，空缓存）、合并"""
+        tts = make_tts('fake:latency=0.05', self._cache_dir('pipeline'))
+        text = sample_text()
+        completed: List[float] = []
+
+        started = time.perf_counter()
+        chunks = TextProcessor.smart_chunk(text, self.chunk_size)
+        scheduler = SynthesisScheduler(tts, max_workers=self.workers)
+        paths = scheduler.run(
+            chunks, engine='fake',
+            on_progress=lambda done, total, index, path: completed.append(time.perf_counter())
+        )
+        merged = AudioMerger.merge([p for p in paths if p])
+        elapsed = time.perf_counter() - started
+        os.remove(merged)
+        tts.cache_manager.flush()
+
+        # 块间完成间隔，反映工作池实际的出块节奏
+        gaps = [b - a for a, b in zip([started] + completed, completed)]
+        return [record('pipeline', len(chunks), elapsed, gaps,
+                       failed=paths.count(None), unique=scheduler.unique_count,
+                       reused=scheduler.reused_sentences)]
+
+# ==================== 命令行入口 ====================
+def print_table(results: List[Dict]):
+    def fmt(value):
+        return '-' if value is None else f'{value:g}' if isinstance(value, float) else str(value)
+
+    columns = ['case', 'items', 'seconds', 'per_sec', 'p50_ms', 'p99_ms', 'peak_rss_mb']
+    rows = [[fmt(r[c]) for c in columns] for r in results]
+    widths = [max(len(c), *(len(row[i]) for row in rows)) for i, c in enumerate(columns)]
+    print('  '.join(c.ljust(w) for c, w in zip(columns, widths)))
+    for row, result in zip(rows, results):
+        extra = {k: v for k, v in result.items() if k not in columns}
+        print('  '.join(v.ljust(w) for v, w in zip(row, widths)), json.dumps(extra, ensure_ascii=False))
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="用确定性假引擎离线测量TTS流水线性能")
+    parser.add_argument('--cases', default=','.join(CASES), help=f"逗号分隔的项目: {', '.join(CASES)}")
+    parser.add_argument('--chunk-size', type=int, default=400, help="分块大小（字符）")
+    parser.add_argument('--workers', type=int, default=8, help="合成并发数")
+    parser.add_argument('--repeat', type=int, default=5, help="分块和合并的重复次数")
+    parser.add_argument('--sizes-mb', default='1,4', help="合成文本大小（MB，逗号分隔）")
+    parser.add_argument('--json', help="把结果写入JSON文件")
+    return parser.parse_args(argv)
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    cases = [c.strip() for c in args.cases.split(',') if c.strip()]
+    unknown = [c for c in cases if c not in CASES]
+    if unknown:
+        print(f"未知的项目: {', '.join(unknown)}")
+        return 2
+
+    work_dir = tempfile.mkdtemp(prefix='tts_bench_')
+    # 引擎和合并产生的临时文件也放进工作目录，结束后一并删除
+    tempfile.tempdir = work_dir
+    try:
+        benchmarks = Benchmarks(
+            work_dir, args.chunk_size, args.workers, args.repeat,
+            [float(s) for s in args.sizes_mb.split(',') if s.strip()]
+        )
+        results = []
+        for case in cases:
+            results.extend(getattr(benchmarks, case)())
+    finally:
+        tempfile.tempdir = None
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print_table(results)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({
+                'timestamp': time.time(),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'args': vars(args),
+                'results': results,
+                'metrics': Metrics.shared().snapshot(),
+            }, f, ensure_ascii=False, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,616 +1,438 @@
 import streamlit as st
-import requests
+import streamlit.components.v1 as components
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+import functools
 import json
 import os
-import base64
-import tempfile
 import time
-import re
-import hashlib
-from datetime import datetime, timedelta
-from typing import Optional, Dict, List
-import threading
-from queue import Queue
-import concurrent.futures
+from typing import Optional, Dict
 
-# ==================== 配置 ====================
-st.set_page_config(
-    page_title="GitHub文本语音播放器 - 增强版",
-    page_icon="🔊",
-    layout="wide",
-    initial_sidebar_state="expanded"
+from tts_core import (
+    AudioEncoder, AudioServer, CacheManager, CircuitBreaker, EventBus, GitHubReader, Metrics,
+    MetricsServer, MultiEngineTTS, PlaybackManager, Prefetcher, SynthesisJobManager, SynthesisScheduler,
+    TextProcessor
 )
 
+# ==================== 配置 ====================
+# 流式播放列表：当前块播放结束后自动播放下一块
+# 播放到的分块和时间记在浏览器sessionStorage中（按任务区分），页面重跑重建列表后从该处继续
+STREAM_PLAYER_JS = """
+<script>
+const doc = window.parent.document;
+const store = window.parent.sessionStorage;
+const key = 'tts-stream-__JOB_ID__';
+const first = __FIRST_CHUNK__;
+const offsets = __OFFSETS__;  // 合并音频中各块的起始秒数；逐块播放时为null
+function chainPlayers() {
+    const marker = doc.getElementById('tts-stream-playlist');
+    if (!marker) return;
+    const box = marker.closest('[data-testid="stVerticalBlock"]');
+    const players = Array.from(box.querySelectorAll('audio'));
+    const saved = JSON.parse(store.getItem(key) || 'null');
+    const resumeAt = saved ? saved.chunk - first : 0;
+    players.forEach((player, i) => {
+        if (player.dataset.chained) return;
+        player.dataset.chained = '1';
+        if (offsets) {
+            // 任务结束后只有一个合并音频，按块记录位置，与逐块播放的记录互通
+            player.addEventListener('timeupdate', () => {
+                let k = 0;
+                while (k + 1 < offsets.length && offsets[k + 1] <= player.currentTime) k++;
+                store.setItem(key, JSON.stringify({chunk: first + k, time: player.currentTime - offsets[k]}));
+            });
+            if (saved && resumeAt >= 0 && resumeAt < offsets.length) {
+                player.currentTime = offsets[resumeAt] + (saved.time || 0);
+                player.play().catch(() => {});
+            }
+            return;
+        }
+        player.addEventListener('timeupdate', () => {
+            store.setItem(key, JSON.stringify({chunk: first + i, time: player.currentTime}));
+        });
+        player.addEventListener('ended', () => {
+            store.setItem(key, JSON.stringify({chunk: first + i + 1, time: 0}));
+            const next = Array.from(box.querySelectorAll('audio'))[i + 1];
+            if (next) next.play();
+        });
+        // 从记录的分块继续；该块尚未就绪时，就绪后自动开始
+        if (i === resumeAt) {
+            if (saved && saved.time) player.currentTime = saved.time;
+            player.play().catch(() => {});
+        }
+    });
+}
+setInterval(chainPlayers, 500);
+</script>
+"""
+
+def configure_page():
+    """页面配置，必须是脚本运行中的第一个Streamlit调用（导入模块时不执行）"""
+    st.set_page_config(
+        page_title="GitHub文本语音播放器 - 增强版",
+        page_icon="🔊",
+        layout="wide",
+        initial_sidebar_state="expanded"
+    )
+
 # ==================== 初始化Session State ====================
 DEFAULT_SESSION_STATES = {
     'audio_file': None,
     'current_position': 0,
-    'playback_state': {},
+    'audio_timeline': None,
+    'audio_start_time': 0,
+    'active_job': None,
+    'stream_job': None,
+    'preview_file': None,
+    'job_start_time': 0,
     'selected_file': "",
     'text_content': "",
     'tts_cache': {},
-    'request_count': 0,
-    'last_request_time': time.time(),
     'available_engines': [],
     'current_engine': "gTTS",
     'use_cache': True,
-    'chunk_size': 400
+    'chunk_size': 400,
+    'max_workers': 4,
+    'scheduler_mode': 'thread',
+    'streaming_mode': True,
+    'prefetch_enabled': False,
+    'prefetch_chunks': 5
 }
 
-for key, value in DEFAULT_SESSION_STATES.items():
-    if key not in st.session_state:
-        st.session_state[key] = value
+def init_session_state():
+    """填充会话状态默认值（仅在Streamlit脚本运行中调用）"""
+    for key, value in DEFAULT_SESSION_STATES.items():
+        if key not in st.session_state:
+            st.session_state[key] = value
 
-# ==================== 缓存管理器 ====================
-class CacheManager:
-    """智能缓存管理器"""
-    
-    def __init__(self, cache_dir='.tts_cache', max_size_mb=100):
-        self.cache_dir = cache_dir
-        self.max_size = max_size_mb * 1024 * 1024  # 转换为字节
-        self.cache_info_file = os.path.join(cache_dir, 'cache_info.json')
-        self._init_cache()
-    
-    def _init_cache(self):
-        """初始化缓存目录"""
-        if not os.path.exists(self.cache_dir):
-            os.makedirs(self.cache_dir)
-        
-        if not os.path.exists(self.cache_info_file):
-            self.cache_info = {}
-            self._save_cache_info()
-        else:
-            with open(self.cache_info_file, 'r', encoding='utf-8') as f:
-                self.cache_info = json.load(f)
-        
-        self._cleanup_old_cache()
-    
-    def _save_cache_info(self):
-        """保存缓存信息"""
-        with open(self.cache_info_file, 'w', encoding='utf-8') as f:
-            json.dump(self.cache_info, f, ensure_ascii=False, indent=2)
-    
-    def _cleanup_old_cache(self):
-        """清理过期缓存"""
+# ==================== 核心库事件 ====================
+def show_event(level: str, message: str):
+    """在发出事件的会话中显示核心库事件；后台线程没有脚本上下文，只打印警告和错误"""
+    if get_script_run_ctx(suppress_warning=True) is None:
+        if level != 'info':
+            print(f"[{level}] {message}")
+        return
+    if level == 'info':
+        st.toast(message)
+    elif level == 'warning':
+        st.warning(message)
+    else:
+        st.error(message)
+
+def attach_playback_user():
+    """为当前会话确定播放记录的用户：已登录时用邮箱，否则为default（每个会话只确定一次）"""
+    if 'playback_user' not in st.session_state:
         try:
-            current_time = time.time()
-            to_delete = []
-            total_size = 0
-            
-            for cache_key, info in list(self.cache_info.items()):
-                cache_path = os.path.join(self.cache_dir, cache_key)
-                if os.path.exists(cache_path):
-                    # 检查是否过期（7天）
-                    if current_time - info.get('timestamp', 0) > 7 * 24 * 3600:
-                        to_delete.append(cache_key)
-                    else:
-                        total_size += os.path.getsize(cache_path)
-                else:
-                    to_delete.append(cache_key)
-            
-            # 如果超过最大大小，按时间清理
-            if total_size > self.max_size:
-                sorted_items = sorted(self.cache_info.items(), 
-                                    key=lambda x: x[1].get('timestamp', 0))
-                for cache_key, _ in sorted_items:
-                    if total_size <= self.max_size * 0.8:  # 保留80%空间
-                        break
-                    cache_path = os.path.join(self.cache_dir, cache_key)
-                    if os.path.exists(cache_path):
-                        total_size -= os.path.getsize(cache_path)
-                        to_delete.append(cache_key)
-            
-            # 删除文件
-            for cache_key in to_delete:
-                cache_path = os.path.join(self.cache_dir, cache_key)
-                if os.path.exists(cache_path):
-                    os.remove(cache_path)
-                if cache_key in self.cache_info:
-                    del self.cache_info[cache_key]
-            
-            if to_delete:
-                self._save_cache_info()
-                st.toast(f"清理了 {len(to_delete)} 个缓存文件")
-                
-        except Exception as e:
-            print(f"缓存清理失败: {e}")
-    
-    def get_cache_key(self, text: str, engine: str, lang: str) -> str:
-        """生成缓存键"""
-        content = f"{text[:500]}_{engine}_{lang}_{len(text)}"
-        return hashlib.md5(content.encode('utf-8')).hexdigest() + '.mp3'
+            email = st.user.get('email')
+        except Exception:
+            email = None
+        st.session_state.playback_user = email or 'default'
+
+# ==================== 共享资源 ====================
+# 以下对象每个进程只构建一次，由所有会话和线程共享；缓存容量和格式在原地调整，不重建
+
+@st.cache_resource(show_spinner=False)
+def get_events() -> EventBus:
+    """共享的事件总线，事件显示在发出事件的会话中"""
+    events = EventBus()
+    events.subscribe(show_event)
+    return events
+
+@st.cache_resource(show_spinner=False)
+def get_tts_system(cache_dir: str = '.tts_cache') -> MultiEngineTTS:
+    """共享的TTS系统及其缓存管理器（每个缓存目录一个）"""
+    return MultiEngineTTS(CacheManager.shared(cache_dir, events=get_events()))
+
+@st.cache_resource(show_spinner=False)
+def get_github_reader() -> GitHubReader:
+    """共享的GitHub阅读器"""
+    return GitHubReader(events=get_events())
+
+@st.cache_resource(show_spinner=False)
+def get_prefetcher(cache_dir: str = '.tts_cache') -> Prefetcher:
+    """共享的预取器（与同缓存目录的TTS系统绑定）"""
+    return Prefetcher(get_github_reader(), get_tts_system(cache_dir))
+
+@st.cache_resource(show_spinner=False)
+def get_job_manager(cache_dir: str = '.tts_cache') -> SynthesisJobManager:
+    """共享的后台合成任务管理器（首次创建时恢复中断的任务）"""
+    return SynthesisJobManager(get_tts_system(cache_dir))
+
+@st.cache_resource(show_spinner=False)
+def get_audio_server() -> Optional[AudioServer]:
+    """共享的本地音频服务，仅在配置了TTS_AUDIO_BASE_URL或TTS_AUDIO_PORT时启用
     
-    def get_cached_audio(self, text: str, engine: str, lang: str) -> Optional[str]:
-        """获取缓存的音频"""
-        cache_key = self.get_cache_key(text, engine, lang)
-        cache_path = os.path.join(self.cache_dir, cache_key)
-        
-        if os.path.exists(cache_path):
-            # 更新访问时间
-            self.cache_info[cache_key] = {
-                'timestamp': time.time(),
-                'engine': engine,
-                'lang': lang,
-                'text_length': len(text)
-            }
-            self._save_cache_info()
-            return cache_path
+    服务地址必须能被浏览器访问；未配置或端口不可用时返回None，使用st.audio同源播放
+    （每次重跑都会重新读入整个文件，只有启用本服务时播放器才按Range分段传输）。
+    """
+    if not (os.environ.get('TTS_AUDIO_BASE_URL') or os.environ.get('TTS_AUDIO_PORT')):
+        return None
+    try:
+        return AudioServer(
+            port=int(os.environ.get('TTS_AUDIO_PORT', 0)),
+            base_url=os.environ.get('TTS_AUDIO_BASE_URL')
+        )
+    except OSError as e:
+        print(f"音频服务启动失败: {e}")
         return None
-    
-    def save_to_cache(self, text: str, engine: str, lang: str, audio_path: str) -> str:
-        """保存到缓存"""
-        cache_key = self.get_cache_key(text, engine, lang)
-        cache_path = os.path.join(self.cache_dir, cache_key)
-        
-        try:
-            import shutil
-            shutil.copy(audio_path, cache_path)
-            
-            self.cache_info[cache_key] = {
-                'timestamp': time.time(),
-                'engine': engine,
-                'lang': lang,
-                'text_length': len(text)
-            }
-            self._save_cache_info()
-            
-            return cache_path
-        except Exception as e:
-            print(f"缓存保存失败: {e}")
-            return audio_path
 
-# ==================== 多引擎TTS系统 ====================
-class MultiEngineTTS:
-    """多引擎TTS系统，支持故障转移"""
+@st.cache_resource(show_spinner=False)
+def get_metrics_server() -> Optional[MetricsServer]:
+    """共享的指标监听，默认在127.0.0.1:9464提供 /metrics 和 /metrics.json
     
-    def __init__(self):
-        self.cache_manager = CacheManager()
-        self.engines = self._detect_available_engines()
-        st.session_state.available_engines = list(self.engines.keys())
+    TTS_METRICS_PORT 指定端口，设为 off 时不启动；端口被占用时返回None。
+    """
+    port = os.environ.get('TTS_METRICS_PORT', '9464')
+    if port.lower() == 'off':
+        return None
+    try:
+        return MetricsServer(port=int(port))
+    except OSError as e:
+        print(f"指标服务启动失败: {e}")
+        return None
+
+@st.cache_resource(show_spinner=False)
+def get_playback_manager(db_file: str = 'playback_state.db') -> PlaybackManager:
+    """共享的播放管理器"""
+    return PlaybackManager(db_file)
+
+# ==================== Streamlit界面 ====================
+def sync_cache_settings(cache_manager: CacheManager):
+    """缓存容量和格式由所有会话共用：新会话显示当前设置，而不是用默认值覆盖"""
+    if st.session_state.get('cache_settings_synced'):
+        return
+    st.session_state.cache_max_mb = cache_manager.max_size // (1024 * 1024)
+    st.session_state.audio_format = cache_manager.encoder.name
+    st.session_state.audio_bitrate = cache_manager.encoder.bitrate_kbps
+    st.session_state.cache_settings_synced = True
+
+def apply_cache_settings():
+    """设置控件的回调：原地调整共享缓存管理器的容量和格式"""
+    get_tts_system().cache_manager.configure(
+        st.session_state.cache_max_mb,
+        AudioEncoder(st.session_state.audio_format, st.session_state.audio_bitrate)
+    )
+
+def read_file_bytes(path: str) -> bytes:
+    """延迟下载的数据源：用户点击下载时才读取文件"""
+    with open(path, 'rb') as f:
+        return f.read()
+
+# 性能面板中各耗时指标的显示名称
+STAGE_LABELS = {
+    'tts_chunking_seconds': '分块',
+    'tts_cache_lookup_seconds': '缓存查找',
+    'tts_cache_write_seconds': '缓存写入',
+    'tts_engine_seconds': '合成',
+    'tts_rate_limit_wait_seconds': '限速等待',
+    'tts_merge_seconds': '合并',
+}
+
+def render_metrics_panel():
+    """性能指标面板：各阶段耗时和关键计数，数据来自进程内共享的指标注册表"""
+    metrics = Metrics.shared()
+    if st.button("重置指标", key='metrics_reset'):
+        metrics.reset()
     
-    def _detect_available_engines(self) -> Dict:
-        """检测可用的TTS引擎"""
-        engines = {}
-        
-        # 1. gTTS (主要)
-        try:
-            from gtts import gTTS
-            engines['gTTS'] = {
-                'name': 'gTTS (Google)',
-                'function': self._use_gtts,
-                'priority': 1,
-                'languages': ['zh-cn', 'en', 'ja', 'ko', 'fr', 'de', 'es', 'ru'],
-                'requires_internet': True
-            }
-        except:
-            pass
-        
-        # 2. Edge TTS (备用)
-        try:
-            import edge_tts
-            engines['edge_tts'] = {
-                'name': 'Edge TTS (微软)',
-                'function': self._use_edge_tts,
-                'priority': 2,
-                'languages': ['zh-CN', 'en-US', 'ja-JP', 'ko-KR'],
-                'requires_internet': True
-            }
-        except:
-            pass
-        
-        # 3. pyttsx3 (离线备用)
-        try:
-            import pyttsx3
-            engines['pyttsx3'] = {
-                'name': 'pyttsx3 (离线)',
-                'function': self._use_pyttsx3,
-                'priority': 3,
-                'languages': ['zh', 'en'],
-                'requires_internet': False
-            }
-        except:
-            pass
-        
-        # 4. 本地TTS API (自定义)
-        engines['local_api'] = {
-            'name': '本地API',
-            'function': self._use_local_api,
-            'priority': 4,
-            'languages': ['zh-cn', 'en'],
-            'requires_internet': False
+    snapshot = metrics.snapshot()
+    rows = [
+        {
+            '阶段': ' '.join([STAGE_LABELS.get(timer['name'], timer['name'])] +
+                            list(timer['labels'].values())),
+            '次数': timer['count'],
+            '平均(ms)': round(timer['avg'] * 1000, 1),
+            '最大(ms)': round(timer['max'] * 1000, 1),
+            '总计(s)': round(timer['sum'], 2),
         }
-        
-        return engines
-    
-    def _rate_limit(self):
-        """智能速率限制"""
-        current_time = time.time()
-        time_since_last = current_time - st.session_state.last_request_time
-        
-        # 动态调整等待时间
-        if st.session_state.request_count > 10:
-            wait_time = 5.0
-        elif st.session_state.request_count > 5:
-            wait_time = 3.0
-        elif time_since_last < 2.0:  # 最少间隔2秒
-            wait_time = 2.0 - time_since_last
-        else:
-            wait_time = 0
-        
-        if wait_time > 0:
-            with st.spinner(f"⏳ 请求限制中，等待 {wait_time:.1f} 秒..."):
-                time.sleep(wait_time)
-        
-        st.session_state.last_request_time = time.time()
-        st.session_state.request_count += 1
+        for timer in sorted(snapshot['timers'],
+                            key=lambda t: list(STAGE_LABELS).index(t['name']) if t['name'] in STAGE_LABELS else 99)
+    ]
+    if rows:
+        st.dataframe(rows, hide_index=True, use_container_width=True)
+    else:
+        st.caption("暂无数据，生成音频后显示")
     
-    def _use_gtts(self, text: str, lang: str = 'zh-cn') -> Optional[str]:
-        """使用gTTS引擎"""
-        try:
-            from gtts import gTTS
-            
-            # 速率限制
-            self._rate_limit()
-            
-            # 清理文本
-            text = text.strip()
-            if not text or len(text) > 5000:
-                return None
-            
-            # 创建临时文件
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.mp3') as tmp_file:
-                temp_path = tmp_file.name
-            
-            # 生成语音
-            tts = gTTS(
-                text=text,
-                lang=lang if lang in ['zh-cn', 'en'] else 'en',
-                slow=False,
-                lang_check=False
-            )
-            
-            tts.save(temp_path)
-            return temp_path
-            
-        except Exception as e:
-            error_msg = str(e)
-            if "429" in error_msg or "Too Many Requests" in error_msg:
-                st.warning("🚫 gTTS API限制，将尝试其他引擎...")
-                return None
-            else:
-                st.error(f"gTTS错误: {error_msg}")
-                return None
+    errors = metrics.total('tts_engine_requests_total', result='error')
+    st.caption(
+        f"引擎失败 {errors:g} · 429 {metrics.total('tts_engine_throttled_total'):g} · "
+        f"熔断跳过 {metrics.total('tts_engine_skipped_total'):g} · "
+        f"故障转移 {metrics.total('tts_failover_total'):g}"
+    )
+    st.caption(
+        f"缓存写入 {metrics.total('tts_cache_write_bytes_total') / 1024 / 1024:.1f} MB · "
+        f"合并输出 {metrics.total('tts_merge_bytes_total') / 1024 / 1024:.1f} MB · "
+        f"统计 {snapshot['uptime']:.0f} 秒"
+    )
+
+def current_stream_job(job_manager: SynthesisJobManager) -> Optional[str]:
+    """本会话以流式播放提交、且仍属于当前文本的任务；文本已更换时清除"""
+    job_id = st.session_state.stream_job
+    if job_id:
+        job = job_manager.get_job(job_id)
+        if job is None or job['text_hash'] != TextProcessor.content_hash(st.session_state.text_content):
+            st.session_state.stream_job = job_id = None
+    return job_id
+
+def attach_synthesis_job(job_manager: SynthesisJobManager, tts_system: MultiEngineTTS,
+                         playback_manager: PlaybackManager, job_id: str, panel, stream: bool):
+    """轮询后台合成任务并显示进度；流式模式下逐块加入播放列表，任务结束后载入合并音频
     
-    def _use_edge_tts(self, text: str, lang: str = 'zh-CN') -> Optional[str]:
-        """使用Edge TTS引擎"""
-        try:
-            import asyncio
-            import edge_tts
-            
-            # 速率限制
-            self._rate_limit()
-            
-            # 清理文本
-            text = text.strip()
-            if not text:
-                return None
-            
-            # 映射语言到voice
-            voice_map = {
-                'zh-CN': 'zh-CN-XiaoxiaoNeural',
-                'en-US': 'en-US-JennyNeural',
-                'ja-JP': 'ja-JP-NanamiNeural',
-                'ko-KR': 'ko-KR-SunHiNeural'
-            }
-            
-            voice = voice_map.get(lang, 'zh-CN-XiaoxiaoNeural')
-            
-            # 创建临时文件
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.mp3') as tmp_file:
-                temp_path = tmp_file.name
-            
-            # 异步生成语音
-            async def generate():
-                communicate = edge_tts.Communicate(text, voice)
-                await communicate.save(temp_path)
-            
-            asyncio.run(generate())
-            return temp_path
-            
-        except Exception as e:
-            st.warning(f"Edge TTS失败: {e}")
-            return None
+    流式任务在每次重跑时都重建播放列表（浏览器从记录的分块继续播放）；任务结束后分块文件
+    被删除，列表改为单个合并音频并定位到记录的分块。合并音频和播放位置只在本会话首次看到
+    任务结束时载入。
+    """
+    job = job_manager.get_job(job_id)
+    if job is None or job['text_hash'] != TextProcessor.content_hash(st.session_state.text_content):
+        return
+    start_time = st.session_state.job_start_time
+    finishing = st.session_state.active_job == job_id
     
-    def _use_pyttsx3(self, text: str, lang: str = 'zh') -> Optional[str]:
-        """使用pyttsx3引擎（离线）"""
-        try:
-            import pyttsx3
-            
-            # 清理文本
-            text = text.strip()
-            if not text:
-                return None
-            
-            # 创建临时文件
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.mp3') as tmp_file:
-                temp_path = tmp_file.name
-            
-            # 初始化引擎
-            engine = pyttsx3.init()
-            
-            # 配置引擎
-            if lang == 'zh':
-                # 尝试设置中文语音（如果有）
-                voices = engine.getProperty('voices')
-                for voice in voices:
-                    if 'chinese' in voice.name.lower() or 'zh' in voice.id.lower():
-                        engine.setProperty('voice', voice.id)
-                        break
-            
-            engine.setProperty('rate', 150)
-            engine.setProperty('volume', 0.9)
-            
-            # 保存到文件
-            engine.save_to_file(text, temp_path)
-            engine.runAndWait()
-            
-            return temp_path
-            
-        except Exception as e:
-            st.warning(f"pyttsx3失败: {e}")
-            return None
+    with panel:
+        if job['status'] == 'running' and st.button("⏹️ 停止合成", key=f"stop_{job_id}"):
+            job_manager.stop(job_id)
+        progress_bar = st.progress(0)
+        status_text = st.empty()
+        if stream:
+            merged = job['status'] != 'running' and job['merged'] and os.path.exists(job['merged'])
+            playlist = st.container()
+            with playlist:
+                st.markdown('<span id="tts-stream-playlist"></span>', unsafe_allow_html=True)
+                components.html(
+                    STREAM_PLAYER_JS.replace('__JOB_ID__', job_id)
+                    .replace('__FIRST_CHUNK__', str(job['start_index']))
+                    .replace('__OFFSETS__', json.dumps(job['offsets']) if merged else 'null'),
+                    height=0
+                )
+                if merged:
+                    st.audio(job['merged'], format=AudioEncoder.mime_for(job['merged']))
+            stream = not merged
     
-    def _use_local_api(self, text: str, lang: str = 'zh-cn') -> Optional[str]:
-        """使用本地TTS API（可配置）"""
-        # 这里可以配置你自己的TTS API
-        api_url = st.session_state.get('local_api_url', '')
-        
-        if not api_url:
-            return None
-        
-        try:
-            # 示例：调用本地部署的TTS服务
-            payload = {
-                'text': text[:1000],  # 限制长度
-                'lang': lang,
-                'speed': 1.0
-            }
-            
-            response = requests.post(
-                api_url,
-                json=payload,
-                timeout=30
-            )
-            
-            if response.status_code == 200:
-                with tempfile.NamedTemporaryFile(delete=False, suffix='.mp3') as tmp_file:
-                    tmp_file.write(response.content)
-                    return tmp_file.name
-            
-        except:
-            pass
-        
-        return None
+    shown = 0
+    while True:
+        job = job_manager.get_job(job_id)
+        chunks = job['chunks']
+        done = sum(1 for chunk in chunks if chunk['status'] != 'pending')
+        progress_bar.progress(done / len(chunks) if chunks else 1.0)
+        status_text.text(f"已完成 {done}/{len(chunks)} 块（从第 {job['start_index'] + 1} 块开始）...")
+        
+        # 连续就绪的块依次加入播放列表
+        while stream and shown < len(chunks) and chunks[shown]['status'] == 'done':
+            # 合并后分块目录随即删除，读不到时停止追加
+            try:
+                with open(chunks[shown]['audio'] or '', 'rb') as f:
+                    data = f.read()
+            except FileNotFoundError:
+                break
+            with playlist:
+                st.caption(f"第 {chunks[shown]['index'] + 1} 块")
+                st.audio(data, format=AudioEncoder.mime_for(chunks[shown]['audio']),
+                         start_time=int(start_time) if shown == 0 else 0)
+            shown += 1
+        
+        if job['status'] != 'running':
+            break
+        time.sleep(0.5)
     
-    def text_to_speech(self, text: str, engine: str = None, lang: str = 'zh-cn', 
-                      use_cache: bool = True) -> Optional[str]:
-        """智能文本转语音"""
-        
-        # 检查缓存
-        if use_cache and st.session_state.use_cache:
-            cached = self.cache_manager.get_cached_audio(text, engine or st.session_state.current_engine, lang)
-            if cached:
-                st.toast("🎯 使用缓存音频", icon="✅")
-                return cached
-        
-        # 选择引擎
-        if engine is None:
-            engine = st.session_state.current_engine
-        
-        if engine not in self.engines:
-            st.error(f"引擎 {engine} 不可用")
-            engine = st.session_state.available_engines[0] if st.session_state.available_engines else 'gTTS'
-        
-        # 尝试主引擎
-        engine_func = self.engines[engine]['function']
-        result = engine_func(text, lang)
-        
-        # 如果失败，尝试其他引擎
-        if result is None and len(self.engines) > 1:
-            st.info(f"正在尝试备用引擎...")
-            for alt_engine, info in sorted(self.engines.items(), key=lambda x: x[1]['priority']):
-                if alt_engine != engine:
-                    alt_result = info['function'](text, lang)
-                    if alt_result:
-                        st.success(f"✓ 使用 {info['name']}")
-                        result = alt_result
-                        break
-        
-        # 保存到缓存
-        if result and use_cache and st.session_state.use_cache:
-            result = self.cache_manager.save_to_cache(text, engine, lang, result)
-        
-        return result
-
-# ==================== 文本处理器 ====================
-class TextProcessor:
-    """智能文本处理器"""
+    progress_bar.empty()
+    status_text.empty()
+    if stream and shown < len(chunks) and job['merged'] and os.path.exists(job['merged']):
+        # 分块文件已随合并删除，重跑后改由合并音频从记录的分块继续
+        st.rerun()
+    if not finishing:
+        return
+    st.session_state.active_job = None
     
-    @staticmethod
-    def smart_chunk(text: str, max_chars: int = 400) -> List[str]:
-        """智能分块文本"""
-        if not text:
-            return []
-        
-        text = text.strip()
-        if len(text) <= max_chars:
-            return [text]
-        
-        chunks = []
-        
-        # 按段落分割
-        paragraphs = text.split('\n\n')
-        
-        for paragraph in paragraphs:
-            if len(paragraph) <= max_chars:
-                chunks.append(paragraph)
-            else:
-                # 按句子分割
-                sentences = re.split(r'(?<=[。！？；.!?;])', paragraph)
-                current_chunk = ""
-                
-                for sentence in sentences:
-                    if len(current_chunk) + len(sentence) <= max_chars:
-                        current_chunk += sentence
-                    else:
-                        if current_chunk:
-                            chunks.append(current_chunk)
-                        current_chunk = sentence
-                
-                if current_chunk:
-                    chunks.append(current_chunk)
-        
-        # 合并过小的块
-        merged_chunks = []
-        current_merge = ""
-        
+    with panel:
+        failed = next((chunk for chunk in chunks if chunk['status'] == 'failed'), None)
+        if failed:
+            st.error(f"第 {failed['index'] + 1} 块生成失败")
+        if job['status'] == 'stopped':
+            st.warning("合成已停止，再次点击生成将从未完成的块继续")
+        if job.get('error'):
+            st.error(f"合成任务失败: {job['error']}")
+        
+        if job['unique_count'] < len(chunks):
+            st.caption(f"规范化去重后实际合成 {job['unique_count']}/{len(chunks)} 块")
+        if job.get('reused_sentences'):
+            st.caption(f"重复句子复用省去 {job['reused_sentences']} 次合成")
+        
+        # 记录各引擎服务的分块数
+        usage: Dict[str, int] = {}
         for chunk in chunks:
-            if len(current_merge) + len(chunk) <= max_chars:
-                current_merge += " " + chunk if current_merge else chunk
-            else:
-                if current_merge:
-                    merged_chunks.append(current_merge)
-                current_merge = chunk
-        
-        if current_merge:
-            merged_chunks.append(current_merge)
-        
-        return merged_chunks
-    
-    @staticmethod
-    def estimate_tts_time(text: str, chars_per_second: int = 15) -> float:
-        """估计TTS生成时间"""
-        return len(text) / chars_per_second
-
-# ==================== GitHub阅读器 ====================
-class GitHubReader:
-    """GitHub文件阅读器"""
+            if chunk['engine']:
+                usage[chunk['engine']] = usage.get(chunk['engine'], 0) + 1
+        if usage:
+            st.caption("使用引擎: " + "、".join(
+                f"{tts_system.engines[name]['name'] if name in tts_system.engines else name} × {count}"
+                for name, count in usage.items()
+            ))
     
-    def __init__(self):
-        self.headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-            'Accept': 'application/vnd.github.v3+json'
+    if job['merged'] and os.path.exists(job['merged']):
+        st.session_state.audio_file = job['merged']
+        st.session_state.audio_start_time = start_time
+        # 记录各分块在合并音频中的位置，用于换算播放进度
+        st.session_state.audio_timeline = {
+            'text_hash': job['text_hash'],
+            'first_chunk': job['start_index'],
+            'offsets': job['offsets'],
+            'char_offsets': [chunk['start'] for chunk in chunks[:len(job['offsets'])]]
         }
-    
-    def parse_repo_url(self, url: str) -> Optional[tuple]:
-        """解析GitHub URL"""
-        patterns = [
-            r'github\.com/([^/]+)/([^/]+)(?:/tree/[^/]+/(.+))?',
-            r'https://github\.com/([^/]+)/([^/]+)(?:/tree/[^/]+/(.+))?',
-        ]
-        
-        for pattern in patterns:
-            match = re.search(pattern, url)
-            if match:
-                owner, repo = match.group(1), match.group(2)
-                path = match.group(3) if match.group(3) else ""
-                return owner, repo, path
-        
-        return None
-    
-    def get_files(self, repo_url: str) -> List[Dict]:
-        """获取仓库中的txt文件"""
-        parsed = self.parse_repo_url(repo_url)
-        if not parsed:
-            return []
         
-        owner, repo, path = parsed
+        # 保存播放状态
+        playback_manager.update_position(
+            st.session_state.playback_user,
+            job['text_hash'],
+            job['file'],
+            job['start_index'],
+            chunks[0]['start'],
+            start_time
+        )
         
-        try:
-            api_url = f"https://api.github.com/repos/{owner}/{repo}/contents/{path}"
-            response = requests.get(api_url, headers=self.headers, timeout=10)
-            
-            if response.status_code == 200:
-                contents = response.json()
-                files = []
-                
-                for item in contents:
-                    if item['type'] == 'file' and item['name'].lower().endswith('.txt'):
-                        files.append({
-                            'name': item['name'],
-                            'path': item['path'],
-                            'url': item['download_url'],
-                            'size': item['size']
-                        })
-                
-                return files
-            else:
-                st.error(f"GitHub API错误: {response.status_code}")
-                return []
-                
-        except Exception as e:
-            st.error(f"连接失败: {str(e)}")
-            return []
-
-# ==================== 播放管理器 ====================
-class PlaybackManager:
-    """播放状态管理器"""
-    
-    def __init__(self, state_file='playback_state.json'):
-        self.state_file = state_file
-        self.load_state()
-    
-    def load_state(self):
-        """加载播放状态"""
-        try:
-            if os.path.exists(self.state_file):
-                with open(self.state_file, 'r', encoding='utf-8') as f:
-                    st.session_state.playback_state = json.load(f)
-        except:
-            st.session_state.playback_state = {}
-    
-    def save_state(self):
-        """保存播放状态"""
-        try:
-            with open(self.state_file, 'w', encoding='utf-8') as f:
-                json.dump(st.session_state.playback_state, f, ensure_ascii=False, indent=2)
-        except:
-            pass
-    
-    def update_position(self, filepath: str, position: int, audio_file: str = None):
-        """更新播放位置"""
-        st.session_state.playback_state[filepath] = {
-            'position': position,
-            'timestamp': time.time(),
-            'audio_file': audio_file
-        }
-        self.save_state()
-    
-    def get_position(self, filepath: str) -> int:
-        """获取播放位置"""
-        return st.session_state.playback_state.get(filepath, {}).get('position', 0)
+        with panel:
+            st.success("✅ 音频生成完成！")
+        # 流式播放时不重跑脚本，以免打断正在播放的列表
+        if not stream:
+            st.rerun()
 
-# ==================== Streamlit界面 ====================
 def main():
+    configure_page()
+    init_session_state()
+    
     st.title("🔊 GitHub文本语音播放器 - 增强版")
     st.markdown("---")
     
-    # 初始化管理器
-    tts_system = MultiEngineTTS()
+    # 获取共享管理器
+    tts_system = get_tts_system()
+    sync_cache_settings(tts_system.cache_manager)
     text_processor = TextProcessor()
-    github_reader = GitHubReader()
-    playback_manager = PlaybackManager()
+    github_reader = get_github_reader()
+    playback_manager = get_playback_manager()
+    job_manager = get_job_manager()
+    get_metrics_server()  # 启动指标监听，不依赖音频服务
+    attach_playback_user()
+    st.session_state.available_engines = list(tts_system.engines.keys())
     
     # 侧边栏
     with st.sidebar:
         st.header("⚙️ 设置")
         
-        # 显示状态
+        # 显示状态（进程内累计，重置指标后重新统计）
+        metrics = Metrics.shared()
+        hits = metrics.total('tts_cache_requests_total', result='hit')
+        requests = metrics.total('tts_cache_requests_total')
         col_stat1, col_stat2 = st.columns(2)
         with col_stat1:
-            st.metric("缓存命中", f"{len(tts_system.cache_manager.cache_info)}")
+            st.metric(
+                "缓存命中率",
+                f"{hits / requests:.0%}" if requests else "-",
+                help=f"按分块合成请求统计：命中 {hits:g} / 请求 {requests:g}，"
+                     f"缓存条目 {tts_system.cache_manager.entry_count()}"
+            )
         with col_stat2:
-            st.metric("请求计数", st.session_state.request_count)
+            st.metric(
+                "引擎请求",
+                f"{metrics.total('tts_engine_requests_total'):g}",
+                help="实际调用引擎的次数（不含缓存命中）"
+            )
         
         # TTS引擎选择
         st.subheader("🎙️ TTS引擎")
@@ -627,12 +449,46 @@ def main():
                 if info['name'] == selected_engine_name:
                     st.session_state.current_engine = key
                     break
+            
+            # 引擎健康状态
+            state_icons = {
+                CircuitBreaker.CLOSED: '🟢',
+                CircuitBreaker.HALF_OPEN: '🟡',
+                CircuitBreaker.OPEN: '🔴'
+            }
+            for key, breaker in tts_system.breakers.items():
+                st.caption(f"{state_icons[breaker.state]} {tts_system.engines[key]['name']} "
+                           f"健康度 {breaker.health:.0%}")
         else:
             st.warning("未检测到TTS引擎，请安装gTTS")
         
         # 缓存设置
         st.subheader("💾 缓存设置")
         st.session_state.use_cache = st.checkbox("启用缓存", value=True)
+        st.number_input(
+            "缓存上限（MB）",
+            min_value=10,
+            max_value=10000,
+            step=10,
+            key='cache_max_mb',
+            on_change=apply_cache_settings,
+            help="所有会话共用，调小后立即按LRU淘汰"
+        )
+        st.selectbox(
+            "音频格式",
+            list(AudioEncoder.FORMATS),
+            key='audio_format',
+            on_change=apply_cache_settings,
+            help="所有会话共用。Opus/AAC低码率单声道适合语音，体积更小；需要ffmpeg。已缓存的分块会在后台转码"
+        )
+        st.select_slider(
+            "码率（kbps）",
+            options=[16, 24, 32, 48, 64],
+            key='audio_bitrate',
+            on_change=apply_cache_settings,
+            disabled=st.session_state.audio_format == 'mp3',
+            help="仅用于Opus/AAC，MP3保持引擎原始码率"
+        )
         if st.button("清理缓存", type="secondary"):
             tts_system.cache_manager._cleanup_old_cache()
             st.rerun()
@@ -648,6 +504,34 @@ def main():
             help="较小的分块可避免API限制"
         )
         
+        # 并发设置
+        st.subheader("⚡ 并发设置")
+        st.session_state.max_workers = st.slider(
+            "并发工作数",
+            min_value=1,
+            max_value=16,
+            value=4,
+            help="同时合成的分块数，受各引擎并发上限约束"
+        )
+        st.session_state.scheduler_mode = st.radio(
+            "调度模式",
+            list(SynthesisScheduler.MODES),
+            horizontal=True
+        )
+        st.session_state.streaming_mode = st.checkbox(
+            "流式播放",
+            value=True,
+            help="首块就绪即开始播放，其余分块在后台继续合成"
+        )
+        
+        # 性能指标
+        with st.expander("📊 性能指标"):
+            live = st.toggle("自动刷新", key='metrics_live', help="每2秒刷新一次面板")
+            st.fragment(render_metrics_panel, run_every=2 if live else None)()
+            metrics_server = get_metrics_server() or get_audio_server()
+            if metrics_server:
+                st.caption(f"Prometheus: {metrics_server.metrics_url} · JSON: {metrics_server.metrics_url}.json")
+        
         st.markdown("---")
         
         # 文件来源选择
@@ -681,7 +565,7 @@ def main():
                 help="支持.txt, .md, .text格式"
             )
             if uploaded_file:
-                st.session_state.text_content = uploaded_file.read().decode('utf-8')
+                st.session_state.text_content = TextProcessor.decode_bytes(uploaded_file.read())
                 st.session_state.selected_file = uploaded_file.name
         
         elif source == "直接输入":
@@ -698,18 +582,47 @@ def main():
         if 'github_files' in st.session_state:
             st.subheader("📋 文件列表")
             for file in st.session_state.github_files[:10]:  # 限制显示数量
-                if st.button(f"📄 {file['name']} ({file['size']}字节)", 
-                           key=f"file_{file['name']}",
+                # 递归列出后不同目录可能有同名文件，按路径区分
+                if st.button(f"📄 {file['path']} ({file['size']}字节)", 
+                           key=f"file_{file['path']}",
                            use_container_width=True):
                     with st.spinner(f"加载 {file['name']}..."):
-                        response = requests.get(file['url'], timeout=10)
-                        if response.status_code == 200:
-                            st.session_state.text_content = response.text
+                        text = github_reader.read_file(file)
+                        if text is not None:
+                            st.session_state.text_content = text
                             st.session_state.selected_file = file['path']
                             st.rerun()
+            
+            # 后台预取下一章
+            st.session_state.prefetch_enabled = st.checkbox(
+                "⏭️ 预取下一章",
+                value=False,
+                help="播放当前文件时，后台下载下一个文件并预先合成开头几块"
+            )
+            if st.session_state.prefetch_enabled:
+                st.session_state.prefetch_chunks = st.slider(
+                    "预合成块数",
+                    min_value=1,
+                    max_value=20,
+                    value=5
+                )
+                next_file = Prefetcher.next_file(
+                    st.session_state.github_files,
+                    st.session_state.selected_file
+                )
+                if next_file:
+                    prefetcher = get_prefetcher()
+                    if prefetcher.schedule(
+                        next_file,
+                        st.session_state.chunk_size,
+                        st.session_state.current_engine,
+                        st.session_state.prefetch_chunks
+                    ):
+                        st.caption(f"正在后台预取: {next_file['path']}")
     
     # 主界面
     if st.session_state.text_content:
+        stream_job = current_stream_job(job_manager)
         col1, col2 = st.columns([2, 1])
         
         with col1:
@@ -722,11 +635,11 @@ def main():
                 with col_stat1:
                     st.metric("字符数", len(st.session_state.text_content))
                 with col_stat2:
-                    chunks = text_processor.smart_chunk(
+                    chunk_count = text_processor.count_chunks(
                         st.session_state.text_content, 
                         st.session_state.chunk_size
                     )
-                    st.metric("分块数", len(chunks))
+                    st.metric("分块数", chunk_count)
                 with col_stat3:
                     est_time = text_processor.estimate_tts_time(st.session_state.text_content)
                     st.metric("预计时间", f"{est_time:.1f}秒")
@@ -749,88 +662,81 @@ def main():
             # 播放控制
             st.subheader("🎵 播放控制")
             
+            # 续播：从上次保存的分块开始，之前的分块不再合成
+            text_hash = TextProcessor.content_hash(st.session_state.text_content)
+            resume = playback_manager.resume_point(
+                st.session_state.playback_user,
+                st.session_state.text_content,
+                st.session_state.chunk_size
+            )
+            start_index, start_time = 0, 0.0
+            if resume and (resume['chunk_index'] > 0 or resume['audio_offset'] > 0):
+                if st.checkbox(
+                    f"⏯️ 从上次位置继续（第 {resume['chunk_index'] + 1}/{chunk_count} 块，"
+                    f"块内 {resume['audio_offset']:.0f} 秒）",
+                    value=True
+                ):
+                    start_index, start_time = resume['chunk_index'], resume['audio_offset']
+            
             col_btn1, col_btn2 = st.columns(2)
             
             with col_btn1:
                 if st.button("▶️ 生成并播放", type="primary", use_container_width=True):
                     if st.session_state.text_content:
-                        progress_bar = st.progress(0)
-                        status_text = st.empty()
+                        # 文本修改后分块边界只在修改处附近变化，其余分块直接命中缓存
+                        if st.session_state.use_cache:
+                            spans = text_processor.chunk_spans(
+                                st.session_state.text_content,
+                                st.session_state.chunk_size
+                            )[start_index:]
+                            reused = sum(
+                                1 for start, end in spans
+                                if tts_system.cached_audio(st.session_state.text_content[start:end],
+                                                           st.session_state.current_engine, 'zh-cn')
+                            )
+                            st.caption(f"复用 {reused} 块缓存音频，需合成 {len(spans) - reused} 块")
                         
-                        # 分块生成音频
-                        all_audio_files = []
-                        chunks = text_processor.smart_chunk(
+                        # 在后台任务中合成（续播时跳过已播放的分块），界面交互不会中断任务
+                        previous_job = st.session_state.active_job or stream_job
+                        st.session_state.active_job = job_manager.submit(
                             st.session_state.text_content,
-                            st.session_state.chunk_size
+                            st.session_state.selected_file,
+                            chunk_size=st.session_state.chunk_size,
+                            engine=st.session_state.current_engine,
+                            lang='zh-cn',
+                            use_cache=st.session_state.use_cache,
+                            start_index=start_index,
+                            max_workers=st.session_state.max_workers,
+                            mode=st.session_state.scheduler_mode
                         )
-                        
-                        for i, chunk in enumerate(chunks):
-                            status_text.text(f"生成第 {i+1}/{len(chunks)} 块...")
-                            progress_bar.progress((i + 1) / len(chunks))
-                            
-                            audio_path = tts_system.text_to_speech(
-                                text=chunk,
-                                lang='zh-cn',
-                                use_cache=st.session_state.use_cache
-                            )
-                            
-                            if audio_path:
-                                all_audio_files.append(audio_path)
-                            else:
-                                st.error(f"第 {i+1} 块生成失败")
-                                break
-                        
-                        if all_audio_files:
-                            # 合并音频文件
-                            status_text.text("合并音频文件中...")
-                            
-                            try:
-                                from pydub import AudioSegment
-                                combined = AudioSegment.empty()
-                                
-                                for audio_file in all_audio_files:
-                                    if os.path.exists(audio_file):
-                                        audio = AudioSegment.from_mp3(audio_file)
-                                        combined += audio
-                                        # 添加短暂间隔
-                                        combined += AudioSegment.silent(duration=100)
-                                
-                                # 保存合并文件
-                                with tempfile.NamedTemporaryFile(delete=False, suffix='.mp3') as tmp_file:
-                                    merged_path = tmp_file.name
-                                
-                                combined.export(merged_path, format="mp3")
-                                st.session_state.audio_file = merged_path
-                                
-                                # 保存播放状态
-                                playback_manager.update_position(
-                                    st.session_state.selected_file,
-                                    0,
-                                    merged_path
-                                )
-                                
-                                st.success("✅ 音频生成完成！")
-                                st.rerun()
-                                
-                            except Exception as e:
-                                st.error(f"音频合并失败: {e}")
-                                if all_audio_files:
-                                    st.session_state.audio_file = all_audio_files[0]
-                        
-                        progress_bar.empty()
-                        status_text.empty()
+                        # 本会话之前提交的任务不再被任何界面使用，停止它以免继续占用引擎
+                        if previous_job and previous_job != st.session_state.active_job:
+                            job_manager.stop(previous_job)
+                        st.session_state.job_start_time = start_time
+                        stream_job = st.session_state.active_job if st.session_state.streaming_mode else None
+                        st.session_state.stream_job = stream_job
             
             with col_btn2:
+                played_seconds = st.number_input(
+                    "当前播放时间（秒）",
+                    min_value=0.0,
+                    step=1.0,
+                    help="播放器显示的时间，保存后下次从对应分块继续"
+                )
                 if st.button("⏸️ 保存当前位置", use_container_width=True):
-                    if st.session_state.selected_file and st.session_state.audio_file:
-                        # 这里可以添加实际的播放位置记录
-                        current_pos = len(st.session_state.text_content) // 3
-                        playback_manager.update_position(
+                    timeline = st.session_state.audio_timeline
+                    if timeline and timeline['text_hash'] == text_hash:
+                        chunk_index = playback_manager.save_played(
+                            st.session_state.playback_user,
+                            timeline,
                             st.session_state.selected_file,
-                            current_pos,
-                            st.session_state.audio_file
+                            played_seconds
                         )
-                        st.success(f"位置已保存: {current_pos}")
+                        st.success(f"位置已保存: 第 {chunk_index + 1} 块")
+                    else:
+                        st.warning("请先生成音频")
+            
+            job_panel = st.container()
         
         with col2:
             # 音频播放器
@@ -838,11 +744,13 @@ def main():
             
             if st.session_state.audio_file and os.path.exists(st.session_state.audio_file):
                 try:
-                    with open(st.session_state.audio_file, 'rb') as f:
-                        audio_bytes = f.read()
+                    audio_path = st.session_state.audio_file
+                    download_name = (st.session_state.selected_file.split('/')[-1] +
+                                     os.path.splitext(audio_path)[1])
+                    audio_server = get_audio_server()
                     
                     # 显示音频信息
-                    file_size_kb = len(audio_bytes) / 1024
+                    file_size_kb = os.path.getsize(audio_path) / 1024
                     st.info(f"""
                     **音频信息**
                     - 大小: {file_size_kb:.1f} KB
@@ -850,18 +758,37 @@ def main():
                     - 缓存: {'✅ 已启用' if st.session_state.use_cache else '❌ 未启用'}
                     """)
                     
-                    # 播放器
-                    st.audio(audio_bytes, format='audio/mp3')
-                    
-                    # 下载按钮
-                    st.download_button(
-                        label="💾 下载音频",
-                        data=audio_bytes,
-                        file_name=f"{st.session_state.selected_file.split('/')[-1]}.mp3",
-                        mime="audio/mp3",
-                        use_container_width=True
-                    )
+                    # 播放器（流式播放列表已在左侧播放）；由本地音频服务按Range分段传输
+                    if not stream_job:
+                        if audio_server:
+                            components.html(
+                                audio_server.player_html(audio_path, st.session_state.audio_start_time),
+                                height=60
+                            )
+                        else:
+                            st.audio(audio_path, format=AudioEncoder.mime_for(audio_path),
+                                     start_time=int(st.session_state.audio_start_time))
                     
+                    # 下载按钮：本地音频服务从磁盘流式下载；否则点击时才读取文件，不在每次重跑时读入
+                    if audio_server:
+                        st.link_button(
+                            "💾 下载音频",
+                            audio_server.url_for(audio_path, download_name, download=True),
+                            use_container_width=True
+                        )
+                    else:
+                        st.download_button(
+                            label="💾 下载音频",
+                            data=functools.partial(read_file_bytes, audio_path),
+                            file_name=download_name,
+                            mime=AudioEncoder.mime_for(audio_path),
+                            on_click='ignore',
+                            use_container_width=True
+                        )
+                        if not stream_job:
+                            st.caption("未启用本地音频服务：播放器在每次页面刷新时重新读取整个音频文件。"
+                                       "设置 TTS_AUDIO_PORT 后改为按Range分段传输")
+                
                 except Exception as e:
                     st.error(f"加载音频失败: {e}")
             else:
@@ -870,10 +797,35 @@ def main():
                 # 快速试听
                 if st.button("🔊 试听片段", use_container_width=True):
                     sample = st.session_state.text_content[:200]
-                    audio_path = tts_system.text_to_speech(sample, use_cache=True)
+                    audio_path = tts_system.text_to_speech(
+                        sample,
+                        st.session_state.current_engine,
+                        use_cache=st.session_state.use_cache
+                    )
                     if audio_path:
+                        # 未进缓存的试听音频是临时文件，再次试听时删除上一个
+                        previous = st.session_state.preview_file
+                        if previous and previous != audio_path and os.path.exists(previous):
+                            os.remove(previous)
+                        st.session_state.preview_file = (
+                            None if tts_system.cache_manager.owns(audio_path) else audio_path
+                        )
                         st.session_state.audio_file = audio_path
+                        st.session_state.audio_start_time = 0
                         st.rerun()
+        
+        
+        # 附着到当前文本的后台合成任务，显示进度直到任务结束；流式任务结束后仍保留播放列表
+        job_id = st.session_state.active_job or stream_job
+        if job_id:
+            attach_synthesis_job(
+                job_manager,
+                tts_system,
+                playback_manager,
+                job_id,
+                job_panel,
+                job_id == stream_job
+            )
     
     else:
         # 欢迎界面
@@ -0,0 +1,26 @@
+"""
+TTS阅读器核心库：不依赖Streamlit，可在线程池、子进程、命令行和测试中使用
+
+引擎相关的重量级依赖（gTTS、edge-tts、pyttsx3、pydub）在首次使用时才导入。
+"""
+from .audio import AudioEncoder, AudioMerger
+from .cache import CacheManager
+from .engines import MultiEngineTTS
+from .events import EventBus
+from .fake import FakeTTSEngine
+from .github import GitHubReader
+from .jobs import SynthesisJobManager
+from .limits import CircuitBreaker, EngineBudgets, TokenBucket
+from .metrics import Metrics
+from .playback import PlaybackManager
+from .prefetch import Prefetcher
+from .scheduler import SynthesisScheduler
+from .server import AudioServer, MetricsServer
+from .text import TextProcessor
+
+__all__ = [
+    'AudioEncoder', 'AudioMerger', 'AudioServer', 'CacheManager', 'CircuitBreaker',
+    'EngineBudgets', 'EventBus', 'FakeTTSEngine', 'GitHubReader', 'Metrics', 'MetricsServer',
+    'MultiEngineTTS', 'PlaybackManager', 'Prefetcher', 'SynthesisJobManager', 'SynthesisScheduler',
+    'TextProcessor', 'TokenBucket',
+]
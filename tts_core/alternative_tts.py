@@ -0,0 +1,173 @@
+"""
+备用TTS引擎选项
+"""
+import asyncio
+import concurrent.futures
+import importlib.util
+import tempfile
+import threading
+from queue import Queue
+from typing import Dict, Optional
+
+class Pyttsx3Session:
+    """常驻的pyttsx3驱动，在专用线程中按队列串行处理任务"""
+    
+    _instance = None
+    _instance_lock = threading.Lock()
+    
+    @classmethod
+    def shared(cls) -> 'Pyttsx3Session':
+        """进程内共享的会话"""
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+    
+    def __init__(self):
+        self._jobs = Queue()
+        self._voices: Dict[str, Optional[str]] = {}  # 语言 -> 已解析的voice id
+        threading.Thread(target=self._run, name='pyttsx3-driver', daemon=True).start()
+    
+    def _resolve_voice(self, engine, lang: str) -> Optional[str]:
+        """查找语言对应的voice，结果缓存"""
+        if lang not in self._voices:
+            voice_id = None
+            if lang == 'zh':
+                # 尝试设置中文语音（如果有）
+                for voice in engine.getProperty('voices'):
+                    if 'chinese' in voice.name.lower() or 'zh' in voice.id.lower():
+                        voice_id = voice.id
+                        break
+            self._voices[lang] = voice_id
+        return self._voices[lang]
+    
+    def _run(self):
+        """驱动线程：只初始化一次引擎，之后循环处理任务"""
+        try:
+            import pyttsx3
+            engine = pyttsx3.init()
+            default_voice = engine.getProperty('voice')
+            init_error = None
+        except Exception as e:
+            engine, init_error = None, e
+        
+        current = {}
+        while True:
+            text, path, lang, rate, volume, future = self._jobs.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+            if init_error is not None:
+                future.set_exception(init_error)
+                continue
+            try:
+                settings = {
+                    'voice': self._resolve_voice(engine, lang) or default_voice,
+                    'rate': rate,
+                    'volume': volume
+                }
+                # 只在属性变化时重新设置
+                for name, value in settings.items():
+                    if current.get(name) != value:
+                        engine.setProperty(name, value)
+                        current[name] = value
+                
+                engine.save_to_file(text, path)
+                engine.runAndWait()
+                future.set_result(path)
+            except Exception as e:
+                future.set_exception(e)
+    
+    def synthesize(self, text: str, path: str, lang: str = 'zh',
+                   rate: int = 150, volume: float = 0.9, timeout: float = 120) -> str:
+        """提交合成任务并等待完成"""
+        future = concurrent.futures.Future()
+        self._jobs.put((text, path, lang, rate, volume, future))
+        return future.result(timeout)
+
+class EdgeTTSSession:
+    """常驻事件循环，供所有edge-tts请求复用"""
+    
+    _instance = None
+    _instance_lock = threading.Lock()
+    
+    @classmethod
+    def shared(cls) -> 'EdgeTTSSession':
+        """进程内共享的会话"""
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+    
+    def __init__(self):
+        self._loop = asyncio.new_event_loop()
+        threading.Thread(target=self._loop.run_forever, name='edge-tts-loop', daemon=True).start()
+    
+    @staticmethod
+    async def save(text: str, voice: str, path: str) -> str:
+        """生成语音并保存到文件"""
+        import edge_tts
+        communicate = edge_tts.Communicate(text, voice)
+        await communicate.save(path)
+        return path
+    
+    def synthesize(self, text: str, voice: str, path: str, timeout: float = 60) -> str:
+        """在常驻事件循环中执行并等待完成"""
+        future = asyncio.run_coroutine_threadsafe(self.save(text, voice, path), self._loop)
+        return future.result(timeout)
+
+class AlternativeTTS:
+    """备用TTS引擎"""
+    
+    @staticmethod
+    def get_engines():
+        """获取可用的TTS引擎"""
+        engines = []
+        
+        # 检查pyttsx3（只查找模块，不导入）
+        if importlib.util.find_spec('pyttsx3'):
+            engines.append("pyttsx3 (离线)")
+        
+        # 检查edge-tts
+        if importlib.util.find_spec('edge_tts'):
+            engines.append("edge-tts (微软)")
+        
+        return engines
+    
+    @staticmethod
+    def use_pyttsx3(text, lang='zh'):
+        """使用pyttsx3（离线）"""
+        try:
+            # 创建临时文件
+            with tempfile.NamedTemporaryFile(delete=False, suffix='.mp3') as tmp_file:
+                temp_path = tmp_file.name
+            
+            # 复用常驻引擎，语速150、音量0.9
+            return Pyttsx3Session.shared().synthesize(text, temp_path, lang, rate=150, volume=0.9)
+        except Exception as e:
+            print(f"pyttsx3错误: {str(e)}")
+            return None
+    
+    @staticmethod
+    async def use_edge_tts_async(text, voice='zh-CN-XiaoxiaoNeural'):
+        """使用edge-tts（异步）"""
+        try:
+            # 创建临时文件
+            with tempfile.NamedTemporaryFile(delete=False, suffix='.mp3') as tmp_file:
+                temp_path = tmp_file.name
+            
+            # 保存音频
+            return await EdgeTTSSession.save(text, voice, temp_path)
+        except Exception as e:
+            print(f"edge-tts错误: {str(e)}")
+            return None
+    
+    @staticmethod
+    def use_edge_tts(text, voice='zh-CN-XiaoxiaoNeural'):
+        """edge-tts的同步包装，复用常驻事件循环"""
+        try:
+            with tempfile.NamedTemporaryFile(delete=False, suffix='.mp3') as tmp_file:
+                temp_path = tmp_file.name
+            return EdgeTTSSession.shared().synthesize(text, voice, temp_path)
+        except Exception as e:
+            print(f"edge-tts错误: {str(e)}")
+            return None
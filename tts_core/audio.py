@@ -0,0 +1,425 @@
+"""
+音频编码与合并
+"""
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+from .metrics import Metrics
+
+# ==================== 音频编码 ====================
+class AudioEncoder:
+    """输出编码设置：语音内容用低码率单声道Opus/AAC可显著减小缓存和传输体积
+    
+    引擎原生输出MP3；选择其他格式时通过ffmpeg转码。
+    """
+    
+    FORMATS = {
+        'mp3': {'ext': '.mp3', 'format': 'mp3', 'codec': None, 'mime': 'audio/mpeg'},
+        'opus': {'ext': '.ogg', 'format': 'ogg', 'codec': 'libopus', 'mime': 'audio/ogg'},
+        'aac': {'ext': '.m4a', 'format': 'ipod', 'codec': 'aac', 'mime': 'audio/mp4'},
+    }
+    
+    def __init__(self, name: str = 'mp3', bitrate_kbps: int = 32):
+        if name not in self.FORMATS:
+            raise ValueError(f"不支持的音频格式: {name}")
+        self.name = name
+        self.bitrate_kbps = bitrate_kbps
+        self.ext = self.FORMATS[name]['ext']
+        self.mime = self.FORMATS[name]['mime']
+    
+    @property
+    def transcodes(self) -> bool:
+        """引擎输出是否需要转码（MP3保持原样，可逐帧拼接）"""
+        return self.name != 'mp3'
+    
+    @property
+    def suffix(self) -> str:
+        """缓存和分块文件的后缀：转码格式带码率标记（如.32k.ogg），码率变化后旧文件不再匹配"""
+        return f".{self.bitrate_kbps}k{self.ext}" if self.transcodes else self.ext
+    
+    @staticmethod
+    def suffix_of(path: str) -> str:
+        """文件名中第一个点之后的部分，即含码率标记的后缀"""
+        name = os.path.basename(path)
+        return name[name.index('.'):] if '.' in name else ''
+    
+    @classmethod
+    def mime_for(cls, path: str) -> str:
+        """按扩展名确定MIME类型"""
+        ext = os.path.splitext(path)[1].lower()
+        for info in cls.FORMATS.values():
+            if info['ext'] == ext:
+                return info['mime']
+        return 'audio/mpeg'
+    
+    def ffmpeg_args(self) -> List[str]:
+        """ffmpeg输出参数：单声道、指定码率和封装格式"""
+        info = self.FORMATS[self.name]
+        args = ['-c:a', info['codec']] if info['codec'] else []
+        return args + ['-ac', '1', '-b:a', f"{self.bitrate_kbps}k", '-f', info['format']]
+    
+    @staticmethod
+    def run_tool(tool: str, args: List[str]) -> str:
+        """运行ffmpeg/ffprobe，返回标准输出；不可用或失败时抛出RuntimeError"""
+        path = shutil.which(tool)
+        if path is None:
+            raise RuntimeError(f"未找到{tool}")
+        result = subprocess.run([path, '-hide_banner', '-v', 'error'] + args,
+                                capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"{tool}失败: {result.stderr.strip()[-500:]}")
+        return result.stdout
+    
+    @classmethod
+    def probe(cls, path: str) -> Dict:
+        """用ffprobe读取容器元数据中的时长和采样率，不解码音频"""
+        data = json.loads(cls.run_tool('ffprobe', [
+            '-show_entries', 'format=duration:stream=sample_rate',
+            '-select_streams', 'a:0', '-of', 'json', path
+        ]))
+        streams = data.get('streams') or [{}]
+        return {
+            'duration': float(data['format']['duration']),
+            'sample_rate': int(streams[0].get('sample_rate') or 0),
+        }
+    
+    def export(self, segment, output_path: str):
+        """按当前设置导出pydub音频段（单声道、指定码率）"""
+        info = self.FORMATS[self.name]
+        segment.set_channels(1).export(
+            output_path,
+            format=info['format'],
+            codec=info['codec'],
+            bitrate=f"{self.bitrate_kbps}k"
+        )
+    
+    def encode(self, input_path: str, output_path: str):
+        """把任意格式的音频文件转码为当前格式：ffmpeg单次流式转码，不把整段音频读入内存"""
+        self.run_tool('ffmpeg', ['-y', '-i', input_path] + self.ffmpeg_args() + [output_path])
+
+# ==================== 音频合并 ====================
+class AudioMerger:
+    """音频合并器：直接拼接MP3帧，无需解码和重新编码"""
+    
+    # Layer III 比特率表（kbps），按 MPEG-1 / MPEG-2(2.5) 区分
+    _BITRATES = {
+        True: [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+        False: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    }
+    # 采样率表，按版本位（3=MPEG-1, 2=MPEG-2, 0=MPEG-2.5）区分
+    _SAMPLE_RATES = {
+        3: [44100, 48000, 32000],
+        2: [22050, 24000, 16000],
+        0: [11025, 12000, 8000],
+    }
+    
+    # 其他容器格式的文件头（WAV、AIFF、Ogg、FLAC）
+    _OTHER_CONTAINERS = (b'RIFF', b'FORM', b'OggS', b'fLaC')
+    
+    @classmethod
+    def _parse_header(cls, header: bytes) -> Optional[Dict]:
+        """解析MP3帧头，仅支持Layer III"""
+        if len(header) < 4 or header[0] != 0xFF or (header[1] & 0xE0) != 0xE0:
+            return None
+        version = (header[1] >> 3) & 0x03
+        layer = (header[1] >> 1) & 0x03
+        bitrate_index = header[2] >> 4
+        sample_rate_index = (header[2] >> 2) & 0x03
+        if version == 1 or layer != 1 or bitrate_index in (0, 15) or sample_rate_index == 3:
+            return None
+        
+        mpeg1 = version == 3
+        bitrate = cls._BITRATES[mpeg1][bitrate_index] * 1000
+        sample_rate = cls._SAMPLE_RATES[version][sample_rate_index]
+        padding = (header[2] >> 1) & 0x01
+        mono = (header[3] >> 6) == 3
+        
+        return {
+            'version': version,
+            'sample_rate': sample_rate,
+            'mono': mono,
+            'frame_length': (144 if mpeg1 else 72) * bitrate // sample_rate + padding,
+            'samples': 1152 if mpeg1 else 576,
+            'side_info': (17 if mono else 32) if mpeg1 else (9 if mono else 17),
+        }
+    
+    @classmethod
+    def _frame_span(cls, data: bytes):
+        """返回 (起始, 结束, 首帧头信息)，跳过ID3标签和Xing/Info/VBRI信息帧
+        
+        首帧必须紧跟在ID3标签之后（只允许零字节填充），不在文件中间搜索，
+        避免把WAV/AIFF等数据中偶然像帧头的字节当作MP3。
+        """
+        start, end = 0, len(data)
+        if data[:4] in cls._OTHER_CONTAINERS or data[4:8] == b'ftyp':
+            raise ValueError("不是MP3数据")
+        
+        # ID3v2
+        if data[:3] == b'ID3' and len(data) >= 10:
+            size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+            start = 10 + size + (10 if data[5] & 0x10 else 0)
+        # ID3v1
+        if end - start >= 128 and data[end - 128:end - 125] == b'TAG':
+            end -= 128
+        
+        # 首帧紧跟标签（跳过零字节填充），且下一帧也能对齐
+        while start < end and data[start] == 0:
+            start += 1
+        info = cls._parse_header(data[start:start + 4])
+        if info:
+            next_pos = start + info['frame_length']
+            if next_pos + 4 <= end and not cls._parse_header(data[next_pos:next_pos + 4]):
+                info = None
+        if info is None:
+            raise ValueError("未找到MP3帧")
+        
+        # 编码器写入的VBR信息帧只描述单个文件，拼接后应去掉
+        tag_offset = start + 4 + info['side_info']
+        if data[tag_offset:tag_offset + 4] in (b'Xing', b'Info') or data[start + 36:start + 40] == b'VBRI':
+            start += info['frame_length']
+        
+        return start, end, info
+    
+    @staticmethod
+    def _silence_frame_count(info: Dict, duration_ms: int) -> int:
+        """间隔对应的静音帧数（按整帧取整，至少一帧）"""
+        if duration_ms <= 0:
+            return 0
+        return max(1, round(duration_ms / 1000 * info['sample_rate'] / info['samples']))
+    
+    @classmethod
+    def gap_seconds(cls, info: Dict, gap_ms: int) -> float:
+        """拼接时实际写入的间隔时长（秒）"""
+        return cls._silence_frame_count(info, gap_ms) * info['samples'] / info['sample_rate']
+    
+    @staticmethod
+    def _silence_frames(template: bytes, info: Dict, duration_ms: int) -> bytes:
+        """根据模板帧头生成静音帧：无CRC、无填充，边信息和主数据全为零"""
+        count = AudioMerger._silence_frame_count(info, duration_ms)
+        if count == 0:
+            return b''
+        header = bytes([
+            template[0],
+            template[1] | 0x01,
+            template[2] & ~0x02 & 0xFF,
+            template[3],
+        ])
+        frame_length = AudioMerger._parse_header(header)['frame_length']
+        frame = header + bytes(frame_length - 4)
+        return frame * count
+    
+    @staticmethod
+    def keep(source: str, target: str) -> bool:
+        """把分块音频固定到target，之后缓存淘汰或转码删除源文件也不受影响
+        
+        优先硬链接（不占额外空间），跨文件系统时复制；源文件已不存在时返回False。
+        """
+        try:
+            try:
+                os.link(source, target + '.part')
+            except OSError:
+                if not os.path.exists(source):
+                    return False
+                shutil.copyfile(source, target + '.part')
+            os.replace(target + '.part', target)
+            return True
+        except OSError as e:
+            print(f"固定分块音频失败 {source}: {e}")
+            return False
+    
+    @classmethod
+    def merge(cls, audio_files: List[str], gap_ms: int = 100,
+              encoder: Optional[AudioEncoder] = None) -> str:
+        """合并多个音频文件，块之间插入短暂间隔，返回合并后的文件路径
+        
+        MP3分块先逐帧拼接；输出Opus/AAC时再由ffmpeg整体流式转码一次。
+        分块已是其他格式时用ffmpeg的concat分离器直接复制音频流，不解码整本书。
+        任一分块音频缺失时抛出FileNotFoundError，不会跳过缺失的块。
+        """
+        missing = [path for path in audio_files if not path or not os.path.exists(path)]
+        if missing:
+            raise FileNotFoundError(f"{len(missing)} 个分块音频缺失，无法合并: {missing[0]}")
+        started = time.perf_counter()
+        merged_path = cls._merge(audio_files, gap_ms, encoder)
+        metrics = Metrics.shared()
+        output_format = os.path.splitext(merged_path)[1].lstrip('.')
+        metrics.observe('tts_merge_seconds', time.perf_counter() - started, format=output_format)
+        metrics.inc('tts_merge_bytes_total', os.path.getsize(merged_path), format=output_format)
+        return merged_path
+    
+    @classmethod
+    def concat(cls, audio_files: List[str], encoder: Optional[AudioEncoder] = None) -> str:
+        """无间隔拼接（句子级复用时把句子音频拼回整块），不计入合并指标"""
+        return cls._merge(audio_files, 0, encoder)
+    
+    @classmethod
+    def _merge(cls, audio_files: List[str], gap_ms: int, encoder: Optional[AudioEncoder]) -> str:
+        encoder = encoder or AudioEncoder()
+        if encoder.transcodes:
+            with tempfile.NamedTemporaryFile(delete=False, suffix=encoder.suffix) as tmp_file:
+                merged_path = tmp_file.name
+            try:
+                cls._merge_transcode(audio_files, merged_path, gap_ms, encoder)
+                return merged_path
+            except Exception as e:
+                # 转码不可用（如缺少ffmpeg）时退回MP3
+                print(f"{encoder.name}编码失败，改为输出MP3: {e}")
+                os.remove(merged_path)
+                encoder = AudioEncoder()
+        
+        with tempfile.NamedTemporaryFile(delete=False, suffix=encoder.ext) as tmp_file:
+            merged_path = tmp_file.name
+        
+        try:
+            cls._concat_frames(audio_files, merged_path, gap_ms)
+        except ValueError as e:
+            print(f"帧拼接失败，改用重新编码: {e}")
+            cls._merge_reencode(audio_files, merged_path, gap_ms, encoder)
+        
+        return merged_path
+    
+    @classmethod
+    def _merge_transcode(cls, audio_files: List[str], output_path: str, gap_ms: int,
+                         encoder: AudioEncoder):
+        """输出Opus/AAC：MP3分块逐帧拼成临时MP3后一次转码，其他分块走concat分离器"""
+        with tempfile.TemporaryDirectory(prefix='tts-merge-') as work_dir:
+            concat_path = os.path.join(work_dir, 'concat.mp3')
+            try:
+                cls._concat_frames(audio_files, concat_path, gap_ms)
+            except ValueError:
+                cls._concat_copy(audio_files, output_path, gap_ms, encoder, work_dir)
+                return
+            encoder.encode(concat_path, output_path)
+    
+    @classmethod
+    def _concat_copy(cls, audio_files: List[str], output_path: str, gap_ms: int,
+                     encoder: AudioEncoder, work_dir: str):
+        """ffmpeg concat分离器按顺序复制各块的音频流（-c copy），块之间插入预先编码的静音
+        
+        格式或码率与输出不同的分块（如后台转码尚未完成的旧条目）先单独转码；静音按首块采样率编码一次。
+        """
+        parts = []
+        for i, audio_file in enumerate(audio_files):
+            if AudioEncoder.suffix_of(audio_file) != encoder.suffix:
+                converted = os.path.join(work_dir, f"{i}{encoder.suffix}")
+                encoder.encode(audio_file, converted)
+                audio_file = converted
+            parts.append(os.path.abspath(audio_file))
+        
+        silence = None
+        if gap_ms > 0:
+            sample_rate = AudioEncoder.probe(parts[0])['sample_rate'] or 48000
+            silence = os.path.join(work_dir, f"silence{encoder.ext}")
+            AudioEncoder.run_tool('ffmpeg', [
+                '-y', '-f', 'lavfi', '-i', f"anullsrc=r={sample_rate}:cl=mono",
+                '-t', f"{gap_ms / 1000:.3f}"
+            ] + encoder.ffmpeg_args() + [silence])
+        
+        list_path = os.path.join(work_dir, 'concat.txt')
+        with open(list_path, 'w', encoding='utf-8') as f:
+            for part in parts:
+                for path in ([part, silence] if silence else [part]):
+                    f.write("file '" + path.replace("'", "'\\''") + "'\n")
+        AudioEncoder.run_tool('ffmpeg', [
+            '-y', '-f', 'concat', '-safe', '0', '-i', list_path,
+            '-c', 'copy', '-f', encoder.FORMATS[encoder.name]['format'], output_path
+        ])
+    
+    @classmethod
+    def _concat_frames(cls, audio_files: List[str], output_path: str, gap_ms: int):
+        """逐个读取分块，直接写出MP3帧"""
+        stream_format = None
+        silence = b''
+        
+        with open(output_path, 'wb') as out:
+            for audio_file in audio_files:
+                with open(audio_file, 'rb') as f:
+                    data = f.read()
+                
+                start, end, info = cls._frame_span(data)
+                chunk_format = (info['version'], info['sample_rate'], info['mono'])
+                if stream_format is None:
+                    stream_format = chunk_format
+                    silence = cls._silence_frames(data[start:start + 4], info, gap_ms)
+                elif chunk_format != stream_format:
+                    raise ValueError(f"分块格式不一致: {audio_file}")
+                
+                out.write(memoryview(data)[start:end])
+                # 添加短暂间隔
+                out.write(silence)
+    
+    @classmethod
+    def _mp3_duration(cls, audio_file: str) -> Optional[tuple]:
+        """按帧计数的MP3时长，返回 (秒, 首帧头信息)；不是MP3时返回None"""
+        with open(audio_file, 'rb') as f:
+            data = f.read()
+        try:
+            start, end, info = cls._frame_span(data)
+        except ValueError:
+            return None
+        
+        frames, pos = 0, start
+        while pos + 4 <= end:
+            header = cls._parse_header(data[pos:pos + 4])
+            if not header:
+                break
+            frames += 1
+            pos += header['frame_length']
+        return frames * info['samples'] / info['sample_rate'], info
+    
+    @classmethod
+    def duration(cls, audio_file: str) -> float:
+        """音频时长（秒）：MP3按帧计数，其他格式读容器元数据；都不可用时才用pydub解码"""
+        parsed = cls._mp3_duration(audio_file)
+        if parsed:
+            return parsed[0]
+        try:
+            return AudioEncoder.probe(audio_file)['duration']
+        except (RuntimeError, ValueError, KeyError) as e:
+            print(f"读取时长元数据失败，改为解码: {e}")
+        from pydub import AudioSegment
+        return len(AudioSegment.from_file(audio_file)) / 1000
+    
+    @classmethod
+    def timeline(cls, audio_files: List[str], gap_ms: int = 100) -> List[float]:
+        """各分块在合并音频中的起始时间（秒），与merge的间隔一致
+        
+        MP3逐帧拼接时间隔按整帧写入，这里按首块格式换算实际写入的静音时长。
+        """
+        offsets, position, gap = [], 0.0, None
+        for audio_file in audio_files:
+            offsets.append(position)
+            parsed = cls._mp3_duration(audio_file)
+            if parsed:
+                seconds, info = parsed
+                if gap is None:
+                    gap = cls.gap_seconds(info, gap_ms)
+            else:
+                seconds = cls.duration(audio_file)
+                if gap is None:
+                    gap = gap_ms / 1000
+            position += seconds + gap
+        return offsets
+    
+    @staticmethod
+    def _merge_reencode(audio_files: List[str], output_path: str, gap_ms: int,
+                        encoder: AudioEncoder):
+        """使用pydub解码后按输出格式重新编码（兼容采样率等不一致的MP3分块）
+        
+        统一声道和采样率后一次拼接原始数据，避免逐段相加反复复制整本书。
+        """
+        from pydub import AudioSegment
+        segments = []
+        for audio_file in audio_files:
+            segments.append(AudioSegment.from_file(audio_file))
+            # 添加短暂间隔
+            segments.append(AudioSegment.silent(duration=gap_ms))
+        
+        segments = AudioSegment._sync(*segments)
+        combined = segments[0]._spawn(b''.join(segment.raw_data for segment in segments))
+        encoder.export(combined, output_path)
@@ -0,0 +1,394 @@
+"""
+TTS音频缓存
+"""
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import weakref
+from typing import Dict, List, Optional
+
+from .audio import AudioEncoder
+from .events import EventBus
+from .metrics import Metrics
+from .text import TextProcessor
+
+# ==================== 缓存管理器 ====================
+class CacheManager:
+    """智能缓存管理器，元数据存放在SQLite（WAL模式）索引中"""
+    
+    ACCESS_FLUSH_COUNT = 64       # 累计多少次访问后批量写回
+    ACCESS_FLUSH_INTERVAL = 30    # 或距上次写回超过多少秒
+    TTL = 7 * 24 * 3600           # 缓存有效期（7天）
+    SWEEP_INTERVAL = 600          # 后台过期清理间隔（秒）
+    
+    _instances: Dict[str, 'CacheManager'] = {}
+    _instances_lock = threading.Lock()
+    
+    def __init__(self, cache_dir='.tts_cache', max_size_mb=100, encoder: Optional[AudioEncoder] = None,
+                 events: Optional[EventBus] = None):
+        self.cache_dir = cache_dir
+        self.max_size = max_size_mb * 1024 * 1024  # 转换为字节
+        self.encoder = encoder or AudioEncoder()
+        self.events = events or EventBus()
+        self.cache_info_file = os.path.join(cache_dir, 'cache_info.json')  # 旧版元数据，仅用于迁移
+        self.index_file = os.path.join(cache_dir, 'cache_index.db')
+        self._lock = threading.Lock()
+        self._pending_access: Dict[str, float] = {}
+        self._last_flush = time.time()
+        self._reencode_thread = None
+        self._init_cache()
+        self._start_sweeper()
+        self.start_reencode()
+    
+    @classmethod
+    def shared(cls, cache_dir='.tts_cache', max_size_mb: Optional[int] = None,
+               encoder: Optional[AudioEncoder] = None, events: Optional[EventBus] = None) -> 'CacheManager':
+        """每个缓存目录一个进程内共享的管理器；已存在时原地应用容量和格式设置"""
+        key = os.path.abspath(cache_dir)
+        with cls._instances_lock:
+            manager = cls._instances.get(key)
+            if manager is None:
+                manager = cls._instances[key] = cls(cache_dir, max_size_mb or 100, encoder, events)
+                return manager
+        manager.configure(max_size_mb, encoder)
+        return manager
+    
+    def configure(self, max_size_mb: Optional[int] = None, encoder: Optional[AudioEncoder] = None):
+        """原地调整容量上限和输出格式：容量变小时立即淘汰，格式变化时后台转码已缓存分块"""
+        if max_size_mb and max_size_mb * 1024 * 1024 != self.max_size:
+            with self._lock:
+                self.max_size = max_size_mb * 1024 * 1024
+                self._evict_lru_locked()
+        if encoder and (encoder.name, encoder.bitrate_kbps) != (self.encoder.name, self.encoder.bitrate_kbps):
+            self.encoder = encoder
+            self.start_reencode()
+    
+    def _init_cache(self):
+        """初始化缓存目录和索引"""
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        
+        self._conn = sqlite3.connect(self.index_file, timeout=30, check_same_thread=False)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS cache_entries (
+                    cache_key TEXT PRIMARY KEY,
+                    engine TEXT,
+                    voice TEXT,
+                    lang TEXT,
+                    text_length INTEGER,
+                    size INTEGER,
+                    timestamp REAL
+                )
+            """)
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_cache_timestamp ON cache_entries(timestamp)"
+            )
+        
+        self._migrate_cache_info()
+        self._total_size = self._query_total_size()
+    
+    def _migrate_cache_info(self):
+        """导入旧版cache_info.json后删除"""
+        if not os.path.exists(self.cache_info_file):
+            return
+        try:
+            with open(self.cache_info_file, 'r', encoding='utf-8') as f:
+                cache_info = json.load(f)
+            rows = []
+            for cache_key, info in cache_info.items():
+                cache_path = os.path.join(self.cache_dir, cache_key)
+                if os.path.exists(cache_path):
+                    rows.append((cache_key, info.get('engine'), info.get('voice', ''),
+                                 info.get('lang'), info.get('text_length', 0),
+                                 os.path.getsize(cache_path), info.get('timestamp', 0)))
+            with self._lock, self._conn:
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO cache_entries VALUES (?, ?, ?, ?, ?, ?, ?)", rows
+                )
+            os.remove(self.cache_info_file)
+        except Exception as e:
+            print(f"缓存元数据迁移失败: {e}")
+    
+    def flush(self):
+        """批量写回内存中累积的访问时间"""
+        with self._lock:
+            self._flush_locked()
+    
+    def _flush_locked(self):
+        if self._pending_access:
+            with self._conn:
+                self._conn.executemany(
+                    "UPDATE cache_entries SET timestamp = ? WHERE cache_key = ?",
+                    [(ts, key) for key, ts in self._pending_access.items()]
+                )
+            self._pending_access.clear()
+        self._last_flush = time.time()
+    
+    def entry_count(self) -> int:
+        """缓存条目数"""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM cache_entries").fetchone()[0]
+    
+    def total_size(self) -> int:
+        """缓存当前占用的字节数"""
+        with self._lock:
+            return self._total_size
+    
+    def _query_total_size(self) -> int:
+        """索引中记录的缓存总大小"""
+        return self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache_entries").fetchone()[0]
+    
+    def _delete_entries_locked(self, cache_keys: List[str]):
+        """删除缓存文件和索引记录，并扣减总大小"""
+        if not cache_keys:
+            return
+        freed = 0
+        for cache_key in cache_keys:
+            cache_path = os.path.join(self.cache_dir, cache_key)
+            if os.path.exists(cache_path):
+                os.remove(cache_path)
+            self._pending_access.pop(cache_key, None)
+        with self._conn:
+            for cache_key in cache_keys:
+                row = self._conn.execute(
+                    "SELECT size FROM cache_entries WHERE cache_key = ?", (cache_key,)
+                ).fetchone()
+                if row:
+                    freed += row[0] or 0
+                    self._conn.execute("DELETE FROM cache_entries WHERE cache_key = ?", (cache_key,))
+        self._total_size = max(0, self._total_size - freed)
+    
+    def _evict_lru_locked(self) -> int:
+        """总大小超过上限时按最近最少使用淘汰，直到回落到80%"""
+        if self._total_size <= self.max_size:
+            return 0
+        
+        # 先写回访问时间，保证LRU顺序准确
+        self._flush_locked()
+        to_delete = []
+        remaining = self._total_size
+        for cache_key, size in self._conn.execute(
+                "SELECT cache_key, size FROM cache_entries ORDER BY timestamp"):
+            if remaining <= self.max_size * 0.8:  # 保留80%空间
+                break
+            remaining -= size or 0
+            to_delete.append(cache_key)
+        
+        self._delete_entries_locked(to_delete)
+        return len(to_delete)
+    
+    def _expire_old_entries(self) -> int:
+        """删除超过有效期的缓存"""
+        with self._lock:
+            self._flush_locked()
+            to_delete = [row[0] for row in self._conn.execute(
+                "SELECT cache_key FROM cache_entries WHERE timestamp < ?",
+                (time.time() - self.TTL,)
+            )]
+            self._delete_entries_locked(to_delete)
+            # 与其他进程的写入对齐总大小
+            self._total_size = self._query_total_size()
+            return len(to_delete)
+    
+    def _start_sweeper(self):
+        """启动后台过期清理线程，管理器被回收后线程自动退出"""
+        manager_ref = weakref.ref(self)
+        interval = self.SWEEP_INTERVAL
+        
+        def sweep():
+            while True:
+                manager = manager_ref()
+                if manager is None:
+                    return
+                try:
+                    removed = manager._expire_old_entries()
+                    if removed:
+                        print(f"后台清理了 {removed} 个过期缓存文件")
+                except Exception as e:
+                    print(f"缓存清理失败: {e}")
+                del manager
+                time.sleep(interval)
+        
+        threading.Thread(target=sweep, name='tts-cache-sweeper', daemon=True).start()
+    
+    def _cleanup_old_cache(self):
+        """立即清理过期缓存并执行容量淘汰"""
+        try:
+            removed = self._expire_old_entries()
+            with self._lock:
+                removed += self._evict_lru_locked()
+            
+            if removed:
+                self.events.info(f"清理了 {removed} 个缓存文件")
+        
+        except Exception as e:
+            print(f"缓存清理失败: {e}")
+    
+    @staticmethod
+    def normalize_text(text: str) -> str:
+        """规范化文本，与合成前的规范化一致，仅写法不同的文本共享同一缓存"""
+        return TextProcessor.normalize_for_tts(text)
+    
+    def get_cache_key(self, text: str, engine: str, lang: str,
+                      voice: str = '', params: Optional[Dict] = None, suffix: str = None) -> str:
+        """生成缓存键：完整规范化文本、实际引擎、音色、语言和合成参数的哈希，加格式后缀（转码格式含码率）"""
+        content = json.dumps({
+            'text': self.normalize_text(text),
+            'engine': engine,
+            'voice': voice,
+            'lang': lang,
+            'params': params or {}
+        }, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(content.encode('utf-8')).hexdigest() + (suffix or self.encoder.suffix)
+    
+    def owns(self, path: str) -> bool:
+        """路径是否位于缓存目录（否则是调用方负责删除的临时文件）"""
+        return os.path.dirname(os.path.abspath(path)) == os.path.abspath(self.cache_dir)
+    
+    def get_cached_audio(self, text: str, engine: str, lang: str,
+                         voice: str = '', params: Optional[Dict] = None) -> Optional[str]:
+        """获取缓存的音频（命中时只在内存中记录访问时间，不写磁盘）
+        
+        优先当前输出格式和码率；其他格式或码率的旧条目在后台转码完成前仍可命中。
+        """
+        cache_key = self.get_cache_key(text, engine, lang, voice, params)
+        with self._lock:
+            if not os.path.exists(os.path.join(self.cache_dir, cache_key)):
+                # 同一哈希的其他后缀在索引中按主键范围查找
+                digest = cache_key[:cache_key.index('.')]
+                row = self._conn.execute(
+                    "SELECT cache_key FROM cache_entries WHERE cache_key > ? AND cache_key < ? "
+                    "ORDER BY timestamp DESC LIMIT 1",
+                    (digest + '.', digest + '/')
+                ).fetchone()
+                if not row or not os.path.exists(os.path.join(self.cache_dir, row[0])):
+                    return None
+                cache_key = row[0]
+            
+            self._pending_access[cache_key] = time.time()
+            if (len(self._pending_access) >= self.ACCESS_FLUSH_COUNT or
+                    time.time() - self._last_flush > self.ACCESS_FLUSH_INTERVAL):
+                self._flush_locked()
+        return os.path.join(self.cache_dir, cache_key)
+    
+    def save_to_cache(self, text: str, engine: str, lang: str, audio_path: str,
+                      voice: str = '', params: Optional[Dict] = None) -> str:
+        """保存到缓存，engine应为实际生成音频的引擎；按输出格式转码后存储
+        
+        非MP3的引擎输出（如pyttsx3的WAV）即使输出格式为MP3也要转码，转码不可用时不缓存。
+        保存成功后源文件被移入缓存或删除，调用方改用返回的路径；失败时原样返回源文件。
+        """
+        cache_key = self.get_cache_key(text, engine, lang, voice, params)
+        cache_path = os.path.join(self.cache_dir, cache_key)
+        source_is_mp3 = os.path.splitext(audio_path)[1].lower() == '.mp3'
+        metrics = Metrics.shared()
+        started = time.perf_counter()
+        
+        try:
+            if self.encoder.transcodes or not source_is_mp3:
+                try:
+                    self.encoder.encode(audio_path, cache_path + '.part')
+                    os.replace(cache_path + '.part', cache_path)
+                    os.remove(audio_path)
+                except Exception as e:
+                    if not source_is_mp3:
+                        raise
+                    # 转码不可用（如缺少ffmpeg）时保存原始MP3
+                    print(f"转码失败，保存原始音频: {e}")
+                    cache_key = self.get_cache_key(text, engine, lang, voice, params, '.mp3')
+                    cache_path = os.path.join(self.cache_dir, cache_key)
+                    shutil.move(audio_path, cache_path)
+            else:
+                shutil.move(audio_path, cache_path)
+            
+            # 源文件已移入缓存，记录索引时触发的淘汰可能立即删除新条目，先取大小
+            size = os.path.getsize(cache_path)
+            self._record_entry(cache_key, engine, voice, lang, len(text), time.time())
+            metrics.observe('tts_cache_write_seconds', time.perf_counter() - started)
+            metrics.inc('tts_cache_writes_total')
+            metrics.inc('tts_cache_write_bytes_total', size)
+            return cache_path
+        except Exception as e:
+            print(f"缓存保存失败: {e}")
+            return audio_path
+    
+    def _record_entry(self, cache_key: str, engine: str, voice: str, lang: str,
+                      text_length: int, timestamp: float):
+        """写入索引记录，更新总大小并按需淘汰"""
+        size = os.path.getsize(os.path.join(self.cache_dir, cache_key))
+        with self._lock:
+            with self._conn:
+                row = self._conn.execute(
+                    "SELECT size FROM cache_entries WHERE cache_key = ?", (cache_key,)
+                ).fetchone()
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO cache_entries VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (cache_key, engine, voice, lang, text_length, size, timestamp)
+                )
+            self._pending_access.pop(cache_key, None)
+            self._total_size += size - (row[0] if row else 0)
+            self._evict_lru_locked()
+    
+    def start_reencode(self):
+        """后台把其他格式或码率的已缓存分块转码为当前设置（每个条目只转一次）"""
+        if self._reencode_thread is not None and self._reencode_thread.is_alive():
+            return
+        with self._lock:
+            pending = self._conn.execute(
+                "SELECT COUNT(*) FROM cache_entries WHERE cache_key NOT LIKE ?",
+                ('%' + self.encoder.suffix,)
+            ).fetchone()[0]
+        if not pending:
+            return
+        self._reencode_thread = threading.Thread(
+            target=self._reencode_entries,
+            name='tts-cache-reencode',
+            daemon=True
+        )
+        self._reencode_thread.start()
+    
+    def _reencode_entries(self):
+        """逐条转码：写入新条目后删除旧条目，失败时停止本轮（如缺少ffmpeg）
+        
+        转码期间格式再次变化时，按新格式重新开始一轮。
+        """
+        while True:
+            encoder = self.encoder
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT cache_key, engine, voice, lang, text_length, timestamp "
+                    "FROM cache_entries WHERE cache_key NOT LIKE ?",
+                    ('%' + encoder.suffix,)
+                ).fetchall()
+            
+            converted = 0
+            for cache_key, engine, voice, lang, text_length, timestamp in rows:
+                if self.encoder is not encoder:
+                    break
+                source = os.path.join(self.cache_dir, cache_key)
+                new_key = cache_key[:cache_key.index('.')] + encoder.suffix
+                target = os.path.join(self.cache_dir, new_key)
+                if not os.path.exists(source):
+                    continue
+                try:
+                    encoder.encode(source, target + '.part')
+                    os.replace(target + '.part', target)
+                except Exception as e:
+                    print(f"缓存转码失败，停止本轮转码: {e}")
+                    break
+                self._record_entry(new_key, engine, voice, lang, text_length, timestamp)
+                with self._lock:
+                    self._delete_entries_locked([cache_key])
+                converted += 1
+            
+            if converted:
+                print(f"后台转码了 {converted} 个缓存文件为 {encoder.name}")
+            if self.encoder is encoder:
+                return
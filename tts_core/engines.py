@@ -0,0 +1,483 @@
+"""
+多引擎TTS系统
+"""
+import functools
+import importlib.util
+import os
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional
+
+import requests
+
+from .alternative_tts import EdgeTTSSession, Pyttsx3Session
+from .cache import CacheManager
+from .events import EventBus
+from .fake import FakeTTSEngine, FakeThrottled
+from .limits import CircuitBreaker, EngineBudgets, TokenBucket
+from .metrics import Metrics
+
+# ==================== 多引擎TTS系统 ====================
+class MultiEngineTTS:
+    """多引擎TTS系统，支持故障转移"""
+    
+    # Edge TTS 语言到voice的映射
+    EDGE_VOICES = {
+        'zh-CN': 'zh-CN-XiaoxiaoNeural',
+        'en-US': 'en-US-JennyNeural',
+        'ja-JP': 'ja-JP-NanamiNeural',
+        'ko-KR': 'ko-KR-SunHiNeural'
+    }
+    
+    def __init__(self, cache_manager: Optional[CacheManager] = None, events: Optional[EventBus] = None):
+        self.cache_manager = cache_manager or CacheManager()
+        self.events = events or self.cache_manager.events
+        self.local_api_url = os.environ.get('TTS_LOCAL_API_URL', '')  # 本地TTS API地址
+        self.fake_engines: Dict[str, FakeTTSEngine] = {}              # 基准测试用的假引擎
+        self.engines = self._detect_available_engines()
+        
+        # 并发槽位、令牌桶和熔断器按引擎在进程内共享，已注册的引擎沿用现有预算
+        for name, info in self.engines.items():
+            EngineBudgets.get(name, info.get('max_concurrency', 1), info.get('rate_limit'))
+        self._local = threading.local()  # 当前线程本次调用的限速等待，从引擎耗时中扣除
+    
+    @property
+    def _engine_slots(self) -> Dict[str, threading.BoundedSemaphore]:
+        """每个引擎的并发槽位"""
+        return {name: EngineBudgets.get(name)['slots'] for name in self.engines}
+    
+    @property
+    def _limiters(self) -> Dict[str, TokenBucket]:
+        """联网引擎的令牌桶"""
+        budgets = {name: EngineBudgets.get(name) for name in self.engines}
+        return {name: budget['limiter'] for name, budget in budgets.items() if budget['limiter']}
+    
+    @property
+    def breakers(self) -> Dict[str, CircuitBreaker]:
+        """每个引擎的熔断器"""
+        return {name: EngineBudgets.get(name)['breaker'] for name in self.engines}
+    
+    @staticmethod
+    def _installed(module: str) -> bool:
+        """只检查模块是否安装，不导入（引擎在首次合成时才导入）"""
+        try:
+            return importlib.util.find_spec(module) is not None
+        except (ImportError, ValueError):
+            return False
+    
+    def _detect_available_engines(self) -> Dict:
+        """检测可用的TTS引擎"""
+        engines = {}
+        
+        # 1. gTTS (主要)
+        if self._installed('gtts'):
+            engines['gTTS'] = {
+                'name': 'gTTS (Google)',
+                'function': self._use_gtts,
+                'priority': 1,
+                'languages': ['zh-cn', 'en', 'ja', 'ko', 'fr', 'de', 'es', 'ru'],
+                'requires_internet': True,
+                'max_concurrency': 2,
+                'rate_limit': (0.5, 3),  # 每秒0.5次，突发3次
+                'params': {'slow': False}
+            }
+        
+        # 2. Edge TTS (备用)
+        if self._installed('edge_tts'):
+            engines['edge_tts'] = {
+                'name': 'Edge TTS (微软)',
+                'function': self._use_edge_tts,
+                'priority': 2,
+                'languages': ['zh-CN', 'en-US', 'ja-JP', 'ko-KR'],
+                'requires_internet': True,
+                'max_concurrency': 4,
+                'rate_limit': (3.0, 6),
+                'params': {}
+            }
+        
+        # 3. pyttsx3 (离线备用)
+        if self._installed('pyttsx3'):
+            engines['pyttsx3'] = {
+                'name': 'pyttsx3 (离线)',
+                'function': self._use_pyttsx3,
+                'priority': 3,
+                'languages': ['zh', 'en'],
+                'requires_internet': False,
+                'max_concurrency': 1,  # pyttsx3驱动非线程安全
+                'params': {'rate': 150, 'volume': 0.9}
+            }
+        
+        # 4. 本地TTS API (自定义)
+        engines['local_api'] = {
+            'name': '本地API',
+            'function': self._use_local_api,
+            'priority': 4,
+            'languages': ['zh-cn', 'en'],
+            'requires_internet': False,
+            'max_concurrency': 4,
+            'params': {'speed': 1.0}
+        }
+        
+        # 5. 假引擎 (基准测试/离线开发，设置TTS_FAKE_ENGINE启用)
+        for name, options in FakeTTSEngine.parse_specs(os.environ.get('TTS_FAKE_ENGINE', '')):
+            fake = self.fake_engines[name] = FakeTTSEngine(**options)
+            engines[name] = {
+                'name': f'假引擎 ({name})',
+                'function': functools.partial(self._use_fake, name),
+                'priority': 0,
+                'languages': ['zh-cn', 'en'],
+                'requires_internet': False,
+                'max_concurrency': fake.max_concurrency,
+                'rate_limit': fake.rate_limit,
+                'params': {'seed': fake.seed}
+            }
+        
+        # TTS_ENGINES 限定启用的引擎（逗号分隔），如基准测试只保留假引擎
+        allowed = [name.strip() for name in os.environ.get('TTS_ENGINES', '').split(',') if name.strip()]
+        if allowed:
+            engines = {name: info for name, info in engines.items() if name in allowed}
+        
+        return engines
+    
+    def _resolve_voice(self, engine: str, lang: str) -> str:
+        """引擎针对该语言实际使用的音色"""
+        if engine == 'gTTS':
+            return lang if lang in ['zh-cn', 'en'] else 'en'
+        if engine == 'edge_tts':
+            return self.EDGE_VOICES.get(lang, 'zh-CN-XiaoxiaoNeural')
+        if engine == 'pyttsx3':
+            return 'chinese' if lang == 'zh' else 'default'
+        if engine == 'local_api':
+            return self.local_api_url
+        return lang
+    
+    def _synthesis_profile(self, engine: str, lang: str) -> Dict:
+        """参与缓存键计算的音色和合成参数"""
+        return {
+            'voice': self._resolve_voice(engine, lang),
+            'params': self.engines.get(engine, {}).get('params', {})
+        }
+    
+    def set_budget(self, engine: str, max_concurrency: Optional[int] = None,
+                   rate: Optional[float] = None, burst: Optional[int] = None):
+        """调整引擎的并发上限和速率（进程内全局生效，批量渲染等场景按全局预算设置）"""
+        if engine not in self.engines:
+            return
+        info = self.engines[engine]
+        if max_concurrency:
+            info['max_concurrency'] = max_concurrency
+        if rate:
+            info['rate_limit'] = (rate, burst or max(1, int(rate * 2)))
+        EngineBudgets.configure(engine, max_concurrency, info['rate_limit'] if rate else None)
+    
+    def _rate_limit(self, engine: str):
+        """按引擎令牌桶限速，在工作线程中等待，不占用脚本线程"""
+        # 后台任务已预留令牌时不再排队
+        if getattr(self._local, 'reserved', None) == engine:
+            self._local.reserved = None
+            return
+        limiter = self._limiters.get(engine)
+        if limiter:
+            wait_time = limiter.acquire()
+            Metrics.shared().observe('tts_rate_limit_wait_seconds', wait_time, engine=engine)
+            self._local.wait = getattr(self._local, 'wait', 0.0) + wait_time
+    
+    def _report_rate(self, engine: str, error: Optional[str] = None):
+        """根据请求结果调整引擎速率：429降速，成功逐步恢复"""
+        throttled = error is not None and ("429" in error or "Too Many Requests" in error)
+        if throttled:
+            Metrics.shared().inc('tts_engine_throttled_total', engine=engine)
+        limiter = self._limiters.get(engine)
+        if not limiter:
+            return
+        if throttled:
+            limiter.penalize()
+        elif error is None:
+            limiter.reward()
+    
+    def _use_gtts(self, text: str, lang: str = 'zh-cn') -> Optional[str]:
+        """使用gTTS引擎"""
+        try:
+            from gtts import gTTS
+            
+            # 速率限制
+            self._rate_limit('gTTS')
+            
+            # 清理文本
+            text = text.strip()
+            if not text or len(text) > 5000:
+                return None
+            
+            # 创建临时文件
+            with tempfile.NamedTemporaryFile(delete=False, suffix='.mp3') as tmp_file:
+                temp_path = tmp_file.name
+            
+            # 生成语音
+            tts = gTTS(
+                text=text,
+                lang=self._resolve_voice('gTTS', lang),
+                slow=self.engines['gTTS']['params']['slow'],
+                lang_check=False
+            )
+            
+            tts.save(temp_path)
+            self._report_rate('gTTS')
+            return temp_path
+        
+        except Exception as e:
+            error_msg = str(e)
+            self._report_rate('gTTS', error_msg)
+            if "429" in error_msg or "Too Many Requests" in error_msg:
+                self.events.warning("🚫 gTTS API限制，将尝试其他引擎...")
+                return None
+            else:
+                self.events.error(f"gTTS错误: {error_msg}")
+                return None
+    
+    def _use_edge_tts(self, text: str, lang: str = 'zh-CN') -> Optional[str]:
+        """使用Edge TTS引擎"""
+        try:
+            # 速率限制
+            self._rate_limit('edge_tts')
+            
+            # 清理文本
+            text = text.strip()
+            if not text:
+                return None
+            
+            # 映射语言到voice
+            voice = self._resolve_voice('edge_tts', lang)
+            
+            # 创建临时文件
+            with tempfile.NamedTemporaryFile(delete=False, suffix='.mp3') as tmp_file:
+                temp_path = tmp_file.name
+            
+            # 在常驻事件循环中生成语音
+            EdgeTTSSession.shared().synthesize(text, voice, temp_path)
+            self._report_rate('edge_tts')
+            return temp_path
+        
+        except Exception as e:
+            self._report_rate('edge_tts', str(e))
+            self.events.warning(f"Edge TTS失败: {e}")
+            return None
+    
+    def _use_pyttsx3(self, text: str, lang: str = 'zh') -> Optional[str]:
+        """使用pyttsx3引擎（离线）"""
+        try:
+            # 清理文本
+            text = text.strip()
+            if not text:
+                return None
+            
+            # 创建临时文件：pyttsx3输出WAV（macOS为AIFF），扩展名与实际格式一致，合并和缓存时转码
+            suffix = '.aiff' if sys.platform == 'darwin' else '.wav'
+            with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp_file:
+                temp_path = tmp_file.name
+            
+            # 复用常驻驱动线程，voice按语言解析一次后缓存
+            params = self.engines['pyttsx3']['params']
+            Pyttsx3Session.shared().synthesize(
+                text, temp_path, lang,
+                rate=params['rate'],
+                volume=params['volume']
+            )
+            
+            return temp_path
+        
+        except Exception as e:
+            self.events.warning(f"pyttsx3失败: {e}")
+            return None
+    
+    def _use_local_api(self, text: str, lang: str = 'zh-cn') -> Optional[str]:
+        """使用本地TTS API（可配置）"""
+        # 这里可以配置你自己的TTS API
+        api_url = self.local_api_url
+        
+        if not api_url:
+            return None
+        
+        try:
+            # 示例：调用本地部署的TTS服务
+            payload = {
+                'text': text[:1000],  # 限制长度
+                'lang': lang,
+                'speed': self.engines['local_api']['params']['speed']
+            }
+            
+            response = requests.post(
+                api_url,
+                json=payload,
+                timeout=30
+            )
+            
+            if response.status_code == 200:
+                with tempfile.NamedTemporaryFile(delete=False, suffix='.mp3') as tmp_file:
+                    tmp_file.write(response.content)
+                    return tmp_file.name
+        
+        except:
+            pass
+        
+        return None
+    
+    def _use_fake(self, name: str, text: str, lang: str = 'zh-cn') -> Optional[str]:
+        """使用假引擎（确定性输出，不联网）"""
+        try:
+            self._rate_limit(name)
+            
+            text = text.strip()
+            if not text:
+                return None
+            
+            with tempfile.NamedTemporaryFile(delete=False, suffix='.mp3') as tmp_file:
+                temp_path = tmp_file.name
+            
+            try:
+                self.fake_engines[name].synthesize(text, temp_path)
+            except Exception:
+                os.remove(temp_path)
+                raise
+            self._report_rate(name)
+            return temp_path
+        
+        except FakeThrottled as e:
+            self._report_rate(name, str(e))
+            self.events.warning(f"🚫 {name} 限流，将尝试其他引擎...")
+            return None
+        except Exception as e:
+            self._report_rate(name, str(e))
+            self.events.warning(f"{name} 失败: {e}")
+            return None
+    
+    def _call_engine(self, engine: str, text: str, lang: str) -> Optional[str]:
+        """在引擎并发限制内调用引擎，记录合成耗时（不含排队和限速等待）和结果"""
+        with self._engine_slots[engine]:
+            self._local.wait = 0.0
+            started = time.perf_counter()
+            result = None
+            try:
+                result = self.engines[engine]['function'](text, lang)
+                return result
+            finally:
+                metrics = Metrics.shared()
+                metrics.observe('tts_engine_seconds',
+                                time.perf_counter() - started - self._local.wait, engine=engine)
+                metrics.inc('tts_engine_requests_total', engine=engine,
+                            result='ok' if result else 'error')
+    
+    def _synthesize_with(self, engine: str, text: str, lang: str, use_cache: bool):
+        """使用指定引擎合成，缓存按该引擎及其音色、参数索引，返回 (音频路径, 是否命中缓存)"""
+        profile = self._synthesis_profile(engine, lang)
+        
+        if use_cache:
+            with Metrics.shared().timer('tts_cache_lookup_seconds'):
+                cached = self.cache_manager.get_cached_audio(text, engine, lang, **profile)
+            if cached:
+                self.events.info("🎯 使用缓存音频")
+                return cached, True
+        
+        # 熔断中的引擎直接跳过，不再为每个分块等待失败
+        breaker = self.breakers[engine]
+        if not breaker.allow():
+            Metrics.shared().inc('tts_engine_skipped_total', engine=engine)
+            return None, False
+        
+        result = self._call_engine(engine, text, lang)
+        if result:
+            breaker.record_success()
+        else:
+            breaker.record_failure()
+        
+        # 保存到缓存
+        if result and use_cache:
+            result = self.cache_manager.save_to_cache(text, engine, lang, result, **profile)
+        
+        return result, False
+    
+    def _failover_order(self, engine: str) -> List[str]:
+        """首选引擎在前，其余按熔断状态、健康度、优先级排序"""
+        others = sorted(
+            (name for name in self.engines if name != engine),
+            key=lambda name: (
+                self.breakers[name].state == CircuitBreaker.OPEN,
+                -self.breakers[name].health,
+                self.engines[name]['priority']
+            )
+        )
+        return [engine] + others
+    
+    def synthesize(self, text: str, engine: str = None, lang: str = 'zh-cn',
+                   use_cache: bool = True):
+        """文本转语音，返回 (音频路径, 实际使用的引擎)，未指定engine时使用默认引擎"""
+        if not text.strip():
+            return None, None
+        
+        # 选择引擎
+        if engine is None:
+            engine = self.default_engine()
+        
+        if engine not in self.engines:
+            self.events.error(f"引擎 {engine} 不可用")
+            engine = self.default_engine()
+        
+        # 依次尝试首选引擎和备用引擎（命中备用引擎的缓存同样有效）
+        metrics = Metrics.shared()
+        for i, candidate in enumerate(self._failover_order(engine)):
+            result, from_cache = self._synthesize_with(candidate, text, lang, use_cache)
+            if result:
+                if use_cache:
+                    metrics.inc('tts_cache_requests_total', result='hit' if from_cache else 'miss')
+                if i > 0:
+                    metrics.inc('tts_failover_total', engine=candidate)
+                    self.events.info(f"✓ 使用 {self.engines[candidate]['name']}")
+                return result, candidate
+        
+        if use_cache:
+            metrics.inc('tts_cache_requests_total', result='miss')
+        return None, None
+    
+    def default_engine(self) -> str:
+        """优先级最高的可用引擎"""
+        return min(self.engines, key=lambda name: self.engines[name]['priority'])
+    
+    def synthesize_spare(self, text: str, engine: str, lang: str = 'zh-cn') -> Optional[tuple]:
+        """只用空闲配额合成（后台预取）：原子地取走一个空闲令牌后用该引擎合成并写入缓存
+        
+        引擎不健康或没有空闲令牌时返回None，不排队、不切换备用引擎；否则返回 (音频路径, 是否命中缓存)。
+        """
+        if engine not in self.engines or self.breakers[engine].state != CircuitBreaker.CLOSED:
+            return None
+        limiter = self._limiters.get(engine)
+        if limiter and not limiter.try_acquire():
+            return None
+        self._local.reserved = engine if limiter else None
+        try:
+            return self._synthesize_with(engine, text, lang, use_cache=True)
+        finally:
+            # 命中缓存或熔断跳过时预留的令牌未被使用，不能留给本线程之后的请求
+            self._local.reserved = None
+    
+    def store(self, text: str, engine: str, lang: str, audio_path: str) -> str:
+        """把外部拼接的音频（如句子级复用拼回的整块）按该引擎的音色和参数写入缓存"""
+        return self.cache_manager.save_to_cache(
+            text, engine, lang, audio_path, **self._synthesis_profile(engine, lang)
+        )
+    
+    def cached_audio(self, text: str, engine: str = None, lang: str = 'zh-cn') -> Optional[str]:
+        """只查缓存不合成（依次查首选和备用引擎）"""
+        engine = engine if engine in self.engines else self.default_engine()
+        for candidate in self._failover_order(engine):
+            cached = self.cache_manager.get_cached_audio(
+                text, candidate, lang, **self._synthesis_profile(candidate, lang)
+            )
+            if cached:
+                return cached
+        return None
+    
+    def text_to_speech(self, text: str, engine: str = None, lang: str = 'zh-cn', 
+                      use_cache: bool = True) -> Optional[str]:
+        """智能文本转语音"""
+        return self.synthesize(text, engine, lang, use_cache)[0]
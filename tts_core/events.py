@@ -0,0 +1,50 @@
+"""
+核心库事件接口
+"""
+import threading
+from typing import Callable, List
+
+class EventBus:
+    """事件总线：核心库通过它报告提示、警告和错误，界面或命令行按需订阅
+    
+    回调签名为 callback(level, message)，level为 info / warning / error；
+    回调在发出事件的线程中执行，回调自身的异常不会影响合成。
+    """
+    
+    LEVELS = ('info', 'warning', 'error')
+    
+    def __init__(self):
+        self._listeners: List[Callable[[str, str], None]] = []
+        self._lock = threading.Lock()
+    
+    def subscribe(self, callback: Callable[[str, str], None]) -> Callable[[str, str], None]:
+        """订阅事件，返回回调本身便于之后取消"""
+        with self._lock:
+            if callback not in self._listeners:
+                self._listeners.append(callback)
+        return callback
+    
+    def unsubscribe(self, callback: Callable[[str, str], None]):
+        """取消订阅"""
+        with self._lock:
+            if callback in self._listeners:
+                self._listeners.remove(callback)
+    
+    def emit(self, level: str, message: str):
+        """发出事件；没有订阅者时直接丢弃"""
+        with self._lock:
+            listeners = list(self._listeners)
+        for callback in listeners:
+            try:
+                callback(level, message)
+            except Exception as e:
+                print(f"事件回调失败: {e}")
+    
+    def info(self, message: str):
+        self.emit('info', message)
+    
+    def warning(self, message: str):
+        self.emit('warning', message)
+    
+    def error(self, message: str):
+        self.emit('error', message)
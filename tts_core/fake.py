@@ -0,0 +1,107 @@
+"""
+确定性假TTS引擎：离线生成MP3，用于基准测试和本地开发
+"""
+import hashlib
+import math
+import threading
+import time
+from typing import Dict, List, Optional
+
+# ==================== 假TTS引擎 ====================
+class FakeThrottled(Exception):
+    """模拟服务端限流（429）"""
+
+class FakeTTSEngine:
+    """按文本确定性地生成静音MP3，可配置延迟、失败率和429比例
+    
+    同一文本第N次调用的结果（成功/失败/429及延迟抖动）只由种子、文本和N决定，
+    与线程调度无关，因此基准测试可以重复。
+    """
+    
+    # MPEG-1 Layer III，32kbps，32kHz，单声道；每帧144字节、1152采样（36毫秒）
+    FRAME_HEADER = b'\xff\xfb\x18\xc0'
+    FRAME_LENGTH = 144
+    FRAME_SECONDS = 1152 / 32000
+    
+    DEFAULTS = {
+        'latency': 0.05,           # 每次调用的基础延迟（秒）
+        'jitter': 0.5,             # 延迟抖动，占基础延迟的比例
+        'failure_rate': 0.0,       # 普通失败的概率
+        'throttle_rate': 0.0,      # 返回429的概率
+        'chars_per_second': 5.0,   # 生成音频的语速（字/秒）
+        'max_concurrency': 8,
+        'rate': 0.0,               # 令牌桶速率（次/秒），0表示不限速
+        'seed': 0,
+    }
+    
+    def __init__(self, **options):
+        unknown = set(options) - set(self.DEFAULTS)
+        if unknown:
+            raise ValueError(f"未知的假引擎参数: {', '.join(sorted(unknown))}")
+        config = {**self.DEFAULTS, **options}
+        self.latency = float(config['latency'])
+        self.jitter = float(config['jitter'])
+        self.failure_rate = float(config['failure_rate'])
+        self.throttle_rate = float(config['throttle_rate'])
+        self.chars_per_second = float(config['chars_per_second'])
+        self.max_concurrency = int(config['max_concurrency'])
+        self.rate = float(config['rate'])
+        self.seed = int(config['seed'])
+        self.calls = 0
+        self._attempts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+    
+    @classmethod
+    def parse_specs(cls, spec: str) -> List[tuple]:
+        """解析 TTS_FAKE_ENGINE，返回 [(引擎名, 参数)]
+        
+        格式: "1" 或 "latency=0.02,failure_rate=0.1"；多个引擎用分号分隔，
+        可加名称前缀，如 "fake:failure_rate=0.3;fake_backup:latency=0.01"。
+        """
+        specs = []
+        for i, part in enumerate(p.strip() for p in spec.split(';')):
+            if not part:
+                continue
+            name = 'fake' if i == 0 else f'fake{i + 1}'
+            if ':' in part:
+                name, part = (s.strip() for s in part.split(':', 1))
+            options = {}
+            for item in part.split(','):
+                if '=' in item:
+                    key, value = (s.strip() for s in item.split('=', 1))
+                    options[key] = value
+            specs.append((name, options))
+        return specs
+    
+    @property
+    def rate_limit(self) -> Optional[tuple]:
+        """令牌桶参数 (速率, 突发)，与真实引擎的engine_info一致"""
+        if self.rate <= 0:
+            return None
+        return (self.rate, max(1, int(self.rate * 2)))
+    
+    def _draw(self, text: str) -> float:
+        """本次调用的确定性随机数 [0, 1)"""
+        with self._lock:
+            self.calls += 1
+            attempt = self._attempts.get(text, 0)
+            self._attempts[text] = attempt + 1
+        digest = hashlib.sha256(f"{self.seed}:{attempt}:{text}".encode('utf-8')).digest()
+        return int.from_bytes(digest[:8], 'big') / 2 ** 64
+    
+    def audio_bytes(self, text: str) -> bytes:
+        """文本对应的MP3数据：时长按语速计算，内容只取决于文本长度"""
+        seconds = len(text) / self.chars_per_second
+        frames = max(1, math.ceil(seconds / self.FRAME_SECONDS))
+        return (self.FRAME_HEADER + bytes(self.FRAME_LENGTH - 4)) * frames
+    
+    def synthesize(self, text: str, output_path: str):
+        """模拟一次合成：等待延迟后写出MP3，按配置概率抛出失败或429"""
+        draw = self._draw(text)
+        time.sleep(self.latency * (1 + self.jitter * (2 * draw - 1)))
+        if draw < self.throttle_rate:
+            raise FakeThrottled("429 Too Many Requests (fake)")
+        if draw < self.throttle_rate + self.failure_rate:
+            raise RuntimeError("假引擎模拟失败")
+        with open(output_path, 'wb') as f:
+            f.write(self.audio_bytes(text))
@@ -0,0 +1,224 @@
+"""
+GitHub仓库文本读取
+"""
+import concurrent.futures
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+from typing import Dict, List, Optional
+from urllib.parse import quote
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .events import EventBus
+from .text import TextProcessor
+
+# ==================== GitHub阅读器 ====================
+class GitHubReader:
+    """GitHub文件阅读器"""
+    
+    def __init__(self, cache_dir='.github_cache', events: Optional[EventBus] = None):
+        self.events = events or EventBus()
+        self.headers = {
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+            'Accept': 'application/vnd.github.v3+json'
+        }
+        token = os.environ.get('GITHUB_TOKEN')
+        if token:
+            self.headers['Authorization'] = f'token {token}'
+        
+        # 共享连接池，对限流和服务端错误自动重试
+        self.session = requests.Session()
+        retry = Retry(
+            total=3,
+            backoff_factor=0.5,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=('GET', 'HEAD')
+        )
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        
+        # 文件列表缓存（含ETag），用于条件请求；文件内容按blob SHA缓存
+        self.listing_dir = os.path.join(cache_dir, 'listings')
+        self.blob_dir = os.path.join(cache_dir, 'blobs')
+        os.makedirs(self.listing_dir, exist_ok=True)
+        os.makedirs(self.blob_dir, exist_ok=True)
+    
+    def parse_repo_url(self, url: str) -> Optional[tuple]:
+        """解析GitHub URL，返回 (owner, repo, path, ref)"""
+        pattern = r'github\.com/([^/]+)/([^/?#]+)(?:/tree/([^/]+)(?:/(.+))?)?'
+        match = re.search(pattern, url)
+        if not match:
+            return None
+        
+        owner, repo = match.group(1), match.group(2)
+        if repo.endswith('.git'):
+            repo = repo[:-4]
+        ref = match.group(3) or 'HEAD'
+        path = (match.group(4) or "").strip('/')
+        return owner, repo, path, ref
+    
+    def _listing_path(self, api_url: str) -> str:
+        return os.path.join(self.listing_dir, hashlib.sha1(api_url.encode('utf-8')).hexdigest() + '.json')
+    
+    def _load_listing(self, api_url: str) -> Optional[Dict]:
+        try:
+            with open(self._listing_path(api_url), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+    
+    def _save_listing(self, api_url: str, etag: str, files: List[Dict]):
+        path = self._listing_path(api_url)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'etag': etag, 'files': files}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    
+    @staticmethod
+    def _file_entry(owner: str, repo: str, ref: str, item: Dict) -> Dict:
+        path = item['path']
+        return {
+            'name': path.rsplit('/', 1)[-1],
+            'path': path,
+            'url': item.get('download_url') or
+                   f"https://raw.githubusercontent.com/{owner}/{repo}/{quote(ref)}/{quote(path)}",
+            'size': item.get('size', 0),
+            'sha': item.get('sha')
+        }
+    
+    def get_files(self, repo_url: str) -> List[Dict]:
+        """获取仓库（含子目录）中的txt文件
+        
+        使用git trees接口一次递归列出整个仓库，并以ETag发起条件请求，
+        列表未变化时GitHub返回304，直接使用本地缓存。
+        """
+        parsed = self.parse_repo_url(repo_url)
+        if not parsed:
+            return []
+        
+        owner, repo, path, ref = parsed
+        api_url = f"https://api.github.com/repos/{owner}/{repo}/git/trees/{quote(ref)}?recursive=1"
+        cached = self._load_listing(api_url)
+        
+        try:
+            headers = dict(self.headers)
+            if cached and cached.get('etag'):
+                headers['If-None-Match'] = cached['etag']
+            response = self.session.get(api_url, headers=headers, timeout=10)
+            
+            if response.status_code == 304 and cached:
+                files = cached['files']
+            elif response.status_code == 200:
+                tree = response.json()
+                if tree.get('truncated'):
+                    # 仓库过大，树被截断时改为并行逐目录获取
+                    files = self._crawl_contents(owner, repo, path, ref)
+                else:
+                    files = [
+                        self._file_entry(owner, repo, ref, item)
+                        for item in tree.get('tree', [])
+                        if item['type'] == 'blob' and item['path'].lower().endswith('.txt')
+                    ]
+                self._save_listing(api_url, response.headers.get('ETag', ''), files)
+            else:
+                self.events.error(f"GitHub API错误: {response.status_code}")
+                return []
+            
+            # 只保留URL指定目录下的文件
+            if path:
+                files = [f for f in files if f['path'].startswith(path + '/')]
+            return files
+                
+        except Exception as e:
+            if cached:
+                return cached['files']
+            self.events.error(f"连接失败: {str(e)}")
+            return []
+    
+    def _crawl_contents(self, owner: str, repo: str, path: str, ref: str) -> List[Dict]:
+        """使用contents接口按目录层级并行遍历"""
+        files = []
+        pending = [path]
+        
+        def list_dir(dir_path):
+            api_url = f"https://api.github.com/repos/{owner}/{repo}/contents/{quote(dir_path)}"
+            response = self.session.get(api_url, headers=self.headers, params={'ref': ref}, timeout=10)
+            response.raise_for_status()
+            return response.json()
+        
+        with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+            while pending:
+                listings = list(executor.map(list_dir, pending))
+                pending = []
+                for contents in listings:
+                    for item in contents:
+                        if item['type'] == 'dir':
+                            pending.append(item['path'])
+                        elif item['type'] == 'file' and item['name'].lower().endswith('.txt'):
+                            files.append(self._file_entry(owner, repo, ref, item))
+        
+        return files
+    
+    def _blob_path(self, file: Dict) -> str:
+        key = file.get('sha') or hashlib.sha1(file['url'].encode('utf-8')).hexdigest()
+        return os.path.join(self.blob_dir, key)
+    
+    @staticmethod
+    def _blob_sha(path: str) -> str:
+        """计算文件的git blob SHA：sha1("blob <大小>\\0" + 内容)"""
+        digest = hashlib.sha1(f"blob {os.path.getsize(path)}\0".encode('utf-8'))
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(64 * 1024), b''):
+                digest.update(block)
+        return digest.hexdigest()
+    
+    def download_file(self, file: Dict) -> Optional[str]:
+        """下载文件到本地内容缓存（按blob SHA），返回缓存路径
+        
+        已缓存时直接返回；否则流式写入临时文件，校验SHA后原子替换。
+        """
+        blob_path = self._blob_path(file)
+        if os.path.exists(blob_path):
+            return blob_path
+        
+        tmp_path = f"{blob_path}.{threading.get_ident()}.part"
+        try:
+            with self.session.get(file['url'], stream=True, timeout=(10, 60)) as response:
+                if response.status_code != 200:
+                    self.events.error(f"下载失败: {response.status_code}")
+                    return None
+                
+                with open(tmp_path, 'wb') as f:
+                    for block in response.iter_content(chunk_size=64 * 1024):
+                        f.write(block)
+            
+            if file.get('sha') and self._blob_sha(tmp_path) != file['sha']:
+                print(f"文件校验不一致，不写入缓存: {file['path']}")
+                with tempfile.NamedTemporaryFile(delete=False, suffix='.txt') as tmp_file:
+                    unverified_path = tmp_file.name
+                os.replace(tmp_path, unverified_path)
+                return unverified_path
+            
+            os.replace(tmp_path, blob_path)
+            return blob_path
+        except Exception as e:
+            self.events.error(f"下载失败: {str(e)}")
+            return None
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    
+    def read_file(self, file: Dict) -> Optional[str]:
+        """读取文件文本（自动识别UTF-8/GBK编码）"""
+        path = self.download_file(file)
+        if not path:
+            return None
+        with open(path, 'rb') as f:
+            return TextProcessor.decode_bytes(f.read())
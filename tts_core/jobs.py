@@ -0,0 +1,282 @@
+"""
+持久化的后台合成任务
+"""
+import copy
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from typing import Dict, Optional
+
+from .audio import AudioEncoder, AudioMerger
+from .engines import MultiEngineTTS
+from .scheduler import SynthesisScheduler
+from .text import TextProcessor
+
+# ==================== 后台合成任务 ====================
+class SynthesisJobManager:
+    """持久化的后台合成任务：清单写在磁盘上，脚本重跑、刷新页面或服务重启后都能继续
+    
+    清单记录每块的状态、音频路径和实际引擎；进程启动时自动恢复未完成的任务。
+    分块音频在完成时固定到 <jobs_dir>/<任务ID>/，缓存淘汰不会影响尚未合并的任务。
+    任务表在进程内共享，不同配置的管理器实例看到的是同一份任务。
+    """
+    
+    FLUSH_INTERVAL = 2            # 清单写回间隔（秒），期间完成的块合并为一次写入
+    JOB_TTL = 7 * 24 * 3600       # 已结束任务的保留时间
+    MAX_ROUNDS = 3                # 合并前发现分块音频丢失时，连同首轮最多合成的轮数
+    
+    _jobs: Dict[str, Dict] = {}
+    _stops: Dict[str, threading.Event] = {}
+    _running = set()
+    _lock = threading.Lock()
+    
+    def __init__(self, tts_system: MultiEngineTTS, jobs_dir: str = '.tts_jobs'):
+        self.tts_system = tts_system
+        self.jobs_dir = jobs_dir
+        os.makedirs(jobs_dir, exist_ok=True)
+        self._recover()
+    
+    @staticmethod
+    def job_id(text_hash: str, chunk_size: int, engine: str, lang: str, start_index: int) -> str:
+        """同一文本、分块、引擎和起始块的任务共用一个ID，重复提交时附着到已有任务"""
+        content = json.dumps([text_hash, chunk_size, engine, lang, start_index])
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()[:16]
+    
+    def _manifest_path(self, job_id: str) -> str:
+        return os.path.join(self.jobs_dir, f"{job_id}.json")
+    
+    def _text_path(self, job_id: str) -> str:
+        return os.path.join(self.jobs_dir, f"{job_id}.txt")
+    
+    def _chunk_dir(self, job_id: str) -> str:
+        return os.path.join(self.jobs_dir, job_id)
+    
+    def _write_manifest(self, job: Dict):
+        """原子写入清单：先写临时文件再替换，崩溃时不会留下半个文件"""
+        with self._lock:
+            data = json.dumps(job, ensure_ascii=False)
+        path = self._manifest_path(job['id'])
+        with open(path + '.part', 'w', encoding='utf-8') as f:
+            f.write(data)
+        os.replace(path + '.part', path)
+    
+    def _recover(self):
+        """加载磁盘上的任务，继续运行中断的任务，删除过期的已结束任务"""
+        for name in os.listdir(self.jobs_dir):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.jobs_dir, name), 'r', encoding='utf-8') as f:
+                    job = json.load(f)
+            except Exception as e:
+                print(f"任务清单读取失败 {name}: {e}")
+                continue
+            
+            if job['status'] != 'running' and time.time() - job['updated'] > self.JOB_TTL:
+                for path in (self._manifest_path(job['id']), self._text_path(job['id']), job['merged']):
+                    if path and os.path.exists(path):
+                        os.remove(path)
+                shutil.rmtree(self._chunk_dir(job['id']), ignore_errors=True)
+                continue
+            with self._lock:
+                if job['id'] in self._jobs:
+                    continue
+                self._jobs[job['id']] = job
+            if job['status'] == 'running':
+                print(f"恢复中断的合成任务: {job['file']}")
+                self._start(job['id'])
+    
+    def submit(self, text: str, filepath: str, chunk_size: int, engine: str, lang: str = 'zh-cn',
+               use_cache: bool = True, start_index: int = 0, max_workers: int = 4,
+               mode: str = 'thread') -> str:
+        """提交合成任务，返回任务ID；已在运行或已完成的相同任务直接附着"""
+        text_hash = TextProcessor.content_hash(text)
+        job_id = self.job_id(text_hash, chunk_size, engine, lang, start_index)
+        
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job and (job['status'] == 'running' or
+                        (job['status'] == 'done' and job['merged'] and os.path.exists(job['merged']))):
+                return job_id
+        
+        if job is None:
+            spans = TextProcessor.chunk_spans(text, chunk_size)[start_index:]
+            job = {
+                'id': job_id,
+                'file': filepath,
+                'text_hash': text_hash,
+                'chunk_size': chunk_size,
+                'engine': engine,
+                'lang': lang,
+                'start_index': start_index,
+                'created': time.time(),
+                'chunks': [
+                    {'index': start_index + i, 'start': start, 'end': end,
+                     'status': 'pending', 'audio': None, 'engine': None}
+                    for i, (start, end) in enumerate(spans)
+                ],
+                'unique_count': len(spans),
+                'merged': None,
+                'offsets': None,
+            }
+            with open(self._text_path(job_id), 'w', encoding='utf-8') as f:
+                f.write(text)
+        
+        # 新任务或重试失败/停止的任务：只合成尚未完成的块
+        job.update(status='running', use_cache=use_cache, max_workers=max_workers,
+                   mode=mode, updated=time.time(), error=None)
+        with self._lock:
+            self._jobs[job_id] = job
+        self._write_manifest(job)
+        self._start(job_id)
+        return job_id
+    
+    def _start(self, job_id: str):
+        """在后台线程中运行任务（同一任务在进程内只运行一份）"""
+        with self._lock:
+            if job_id in self._running:
+                return
+            self._running.add(job_id)
+            stop = self._stops[job_id] = threading.Event()
+        threading.Thread(
+            target=self._run,
+            args=(job_id, stop),
+            name=f'tts-job-{job_id[:8]}',
+            daemon=True
+        ).start()
+    
+    def _run(self, job_id: str, stop: threading.Event):
+        job = self._jobs[job_id]
+        status, error = 'failed', None
+        try:
+            with open(self._text_path(job_id), 'r', encoding='utf-8') as f:
+                text = f.read()
+            
+            for _ in range(self.MAX_ROUNDS):
+                self._synthesize(job, text, stop)
+                if stop.is_set():
+                    status = 'stopped'
+                    break
+                status = self._finish(job)
+                if status != 'pending':
+                    break
+            if status == 'pending':
+                status, error = 'failed', "分块音频在合并前反复丢失"
+        except Exception as e:
+            print(f"合成任务失败: {e}")
+            error = str(e)
+        finally:
+            with self._lock:
+                job.update(status=status, error=error, updated=time.time())
+                self._running.discard(job_id)
+            self._write_manifest(job)
+    
+    def _synthesize(self, job: Dict, text: str, stop: threading.Event):
+        """合成尚未完成或音频已丢失的块，完成的块随即固定到任务目录"""
+        chunk_dir = self._chunk_dir(job['id'])
+        os.makedirs(chunk_dir, exist_ok=True)
+        with self._lock:
+            todo = [c for c in job['chunks']
+                    if not (c['status'] == 'done' and c['audio'] and os.path.exists(c['audio']))]
+            for chunk in todo:
+                chunk['status'] = 'pending'
+        if not todo:
+            return
+        
+        scheduler = SynthesisScheduler(self.tts_system, job['max_workers'], job['mode'])
+        completed = scheduler.iter_completed(
+            [text[c['start']:c['end']] for c in todo],
+            job['engine'], job['lang'], job['use_cache']
+        )
+        last_write = time.time()
+        temp_files = set()
+        try:
+            for k, audio_path in completed:
+                chunk = todo[k]
+                kept = None
+                if audio_path:
+                    if not self.tts_system.cache_manager.owns(audio_path):
+                        temp_files.add(audio_path)
+                    kept = os.path.join(chunk_dir, f"{chunk['index']}{AudioEncoder.suffix_of(audio_path)}")
+                    if not AudioMerger.keep(audio_path, kept):
+                        kept = None
+                with self._lock:
+                    # 返回的缓存文件在固定前已被淘汰时留待下一轮重新合成
+                    chunk.update(
+                        status='done' if kept else ('pending' if audio_path else 'failed'),
+                        audio=kept,
+                        engine=scheduler.chunk_engines.get(k)
+                    )
+                    job['updated'] = time.time()
+                if stop.is_set():
+                    break
+                if time.time() - last_write >= self.FLUSH_INTERVAL:
+                    self._write_manifest(job)
+                    last_write = time.time()
+        finally:
+            completed.close()
+            # 未进缓存的音频（不使用缓存或写入失败）是临时文件，固定到任务目录后删除
+            for path in temp_files:
+                if os.path.exists(path):
+                    os.remove(path)
+        
+        with self._lock:
+            job['unique_count'] = scheduler.unique_count
+            job['reused_sentences'] = scheduler.reused_sentences
+    
+    def _finish(self, job: Dict) -> str:
+        """合并第一个失败块之前的连续音频，返回任务最终状态
+        
+        已完成但音频文件丢失的块改回pending；仍有pending块时返回'pending'，由调用方重新合成，
+        不会绕过缺失的块合并。
+        """
+        with self._lock:
+            for chunk in job['chunks']:
+                if chunk['status'] == 'done' and not (chunk['audio'] and os.path.exists(chunk['audio'])):
+                    chunk.update(status='pending', audio=None)
+            missing = [c for c in job['chunks'] if c['status'] == 'pending']
+        if missing:
+            print(f"{len(missing)} 个分块音频已丢失，重新合成")
+            return 'pending'
+        
+        prefix = []
+        for chunk in job['chunks']:
+            if chunk['status'] != 'done':
+                break
+            prefix.append(chunk['audio'])
+        
+        if prefix:
+            merged = AudioMerger.merge(prefix, encoder=self.tts_system.cache_manager.encoder)
+            offsets = AudioMerger.timeline(prefix)
+            # 合并结果放在任务目录，替换本任务之前的合并文件，随任务过期删除
+            target = os.path.join(self.jobs_dir, job['id'] + AudioEncoder.suffix_of(merged))
+            shutil.move(merged, target)
+            if job['merged'] and job['merged'] != target and os.path.exists(job['merged']):
+                os.remove(job['merged'])
+            with self._lock:
+                job['merged'], job['offsets'] = target, offsets
+        if len(prefix) < len(job['chunks']):
+            return 'failed'
+        
+        # 全部合并后分块副本不再需要，删除以免在缓存容量之外占用磁盘
+        shutil.rmtree(self._chunk_dir(job['id']), ignore_errors=True)
+        with self._lock:
+            for chunk in job['chunks']:
+                chunk['audio'] = None
+        return 'done'
+    
+    def stop(self, job_id: str):
+        """请求停止任务，已完成的块保留在清单和缓存中"""
+        with self._lock:
+            stop = self._stops.get(job_id)
+        if stop:
+            stop.set()
+    
+    def get_job(self, job_id: str) -> Optional[Dict]:
+        """任务快照"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return copy.deepcopy(job) if job else None
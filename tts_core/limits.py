@@ -0,0 +1,173 @@
+"""
+速率限制与熔断
+"""
+import threading
+import time
+from typing import Dict, Iterable, Optional
+
+# ==================== 速率限制与熔断 ====================
+class TokenBucket:
+    """令牌桶限速器：进程内共享、线程安全，遇到429时自动降速"""
+    
+    def __init__(self, rate: float, burst: int, min_rate: Optional[float] = None):
+        self.max_rate = rate                    # 配置的速率（令牌/秒）
+        self.rate = rate                        # 当前速率，429后降低
+        self.min_rate = min_rate or rate / 16
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.acquired = 0
+        self._lock = threading.Lock()
+    
+    def acquire(self) -> float:
+        """预订一个令牌，在调用线程中等待到可用为止，返回等待秒数"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            self.acquired += 1
+            # 令牌为负表示排队，按当前速率计算轮到自己的时间
+            wait_time = max(0.0, -self.tokens / self.rate)
+        
+        if wait_time > 0:
+            time.sleep(wait_time)
+        return wait_time
+    
+    def try_acquire(self) -> bool:
+        """有空闲令牌时立即取走一个并返回True，否则不排队、返回False（检查和取走在同一把锁内）"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            self.acquired += 1
+            return True
+    
+    def configure(self, rate: float, burst: int):
+        """原地调整配置速率和突发量，保留已排队的令牌状态"""
+        with self._lock:
+            self.max_rate = rate
+            self.rate = rate
+            self.min_rate = rate / 16
+            self.burst = burst
+            self.tokens = min(self.tokens, float(burst))
+    
+    def available(self) -> float:
+        """当前可立即使用的令牌数（不消耗）"""
+        with self._lock:
+            elapsed = time.monotonic() - self.updated
+            return min(self.burst, self.tokens + elapsed * self.rate)
+    
+    def penalize(self):
+        """收到429：速率减半并清空积攒的令牌"""
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = min(self.tokens, 0.0)
+    
+    def reward(self):
+        """请求成功：逐步恢复到配置速率"""
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * 0.1)
+
+class CircuitBreaker:
+    """引擎熔断器：连续失败后断开，冷却后放行单个半开探测"""
+    
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+    
+    def __init__(self, failure_threshold: int = 3, recovery_timeout: float = 30.0,
+                 max_recovery_timeout: float = 600.0):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.max_recovery_timeout = max_recovery_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.health = 1.0  # 成功率的指数移动平均，用于选择最健康的引擎
+        self._timeout = recovery_timeout
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+    
+    def allow(self) -> bool:
+        """是否允许调用该引擎"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self._timeout:
+                self.state = self.HALF_OPEN
+                self._probing = False
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+    
+    def record_success(self):
+        with self._lock:
+            self.health = 0.8 * self.health + 0.2
+            self.failures = 0
+            self.state = self.CLOSED
+            self._timeout = self.recovery_timeout
+            self._probing = False
+    
+    def record_failure(self):
+        with self._lock:
+            self.health = 0.8 * self.health
+            self.failures += 1
+            if self.state == self.HALF_OPEN:
+                # 探测失败，加倍冷却时间
+                self._timeout = min(self.max_recovery_timeout, self._timeout * 2)
+                self._open()
+            elif self.failures >= self.failure_threshold:
+                self._open()
+    
+    def _open(self):
+        self.state = self.OPEN
+        self._opened_at = time.monotonic()
+        self._probing = False
+
+class EngineBudgets:
+    """进程内按引擎共享的并发槽位、令牌桶和熔断器
+    
+    同一进程中的所有TTS系统实例（不同会话配置、预取、后台任务、命令行）共用一份预算，
+    配置不同的实例不会各自拿到一份配额。
+    """
+    
+    _budgets: Dict[str, Dict] = {}
+    _lock = threading.Lock()
+    
+    @classmethod
+    def get(cls, engine: str, max_concurrency: int = 1, rate_limit: Optional[tuple] = None) -> Dict:
+        """引擎的预算 {'slots', 'limiter', 'breaker'}；首次注册时按给定配置创建"""
+        with cls._lock:
+            budget = cls._budgets.get(engine)
+            if budget is None:
+                budget = cls._budgets[engine] = {
+                    'slots': threading.BoundedSemaphore(max_concurrency),
+                    'limiter': TokenBucket(*rate_limit) if rate_limit else None,
+                    'breaker': CircuitBreaker(),
+                }
+            return budget
+    
+    @classmethod
+    def configure(cls, engine: str, max_concurrency: Optional[int] = None,
+                  rate_limit: Optional[tuple] = None):
+        """调整引擎的并发上限或速率，对所有实例生效"""
+        budget = cls.get(engine)
+        with cls._lock:
+            if max_concurrency:
+                # 进行中的调用仍在旧槽位上释放，不受影响
+                budget['slots'] = threading.BoundedSemaphore(max_concurrency)
+            if rate_limit:
+                if budget['limiter'] is None:
+                    budget['limiter'] = TokenBucket(*rate_limit)
+                else:
+                    budget['limiter'].configure(*rate_limit)
+    
+    @classmethod
+    def reset(cls, engines: Optional[Iterable[str]] = None):
+        """清除引擎预算（基准测试等需要从头开始时使用），未指定时清除全部"""
+        with cls._lock:
+            for engine in list(cls._budgets if engines is None else engines):
+                cls._budgets.pop(engine, None)
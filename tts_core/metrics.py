@@ -0,0 +1,169 @@
+"""
+流水线指标：计数器和耗时直方图，可导出为Prometheus文本或JSON
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+# ==================== 指标注册表 ====================
+class Metrics:
+    """进程内指标注册表：线程安全，由所有会话、后台任务和命令行共享
+    
+    计数器名以 _total 结尾；耗时以秒记录为直方图（_seconds），同时保留次数、总和和最大值。
+    标签用关键字参数传入，如 metrics.inc('tts_engine_requests_total', engine='gTTS', result='ok')。
+    """
+    
+    BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+    
+    HELP = {
+        'tts_chunking_seconds': '文本分块耗时（记忆未命中时）',
+        'tts_chunks_total': '分块产生的块数',
+        'tts_chunking_memo_hits_total': '分块记忆命中次数',
+        'tts_cache_lookup_seconds': '合成前的缓存查找耗时',
+        'tts_cache_requests_total': '分块合成请求的缓存命中/未命中（每次合成请求计一次）',
+        'tts_cache_write_seconds': '写入缓存耗时（含转码）',
+        'tts_cache_writes_total': '写入缓存的条目数',
+        'tts_cache_write_bytes_total': '写入缓存的字节数',
+        'tts_engine_seconds': '引擎合成耗时（不含限速等待）',
+        'tts_engine_requests_total': '引擎请求次数（按结果）',
+        'tts_engine_throttled_total': '引擎返回429的次数',
+        'tts_engine_skipped_total': '因熔断跳过引擎的次数',
+        'tts_failover_total': '由备用引擎完成的合成次数',
+        'tts_rate_limit_wait_seconds': '令牌桶限速等待时间',
+        'tts_merge_seconds': '合并音频耗时',
+        'tts_merge_bytes_total': '合并输出的字节数',
+    }
+    
+    _shared = None
+    _shared_lock = threading.Lock()
+    
+    def __init__(self):
+        self._counters: Dict[tuple, float] = {}
+        self._timers: Dict[tuple, Dict] = {}
+        self._lock = threading.Lock()
+        self.started = time.time()
+    
+    @classmethod
+    def shared(cls) -> 'Metrics':
+        """进程内共享的注册表"""
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls()
+            return cls._shared
+    
+    @staticmethod
+    def _key(name: str, labels: Dict) -> tuple:
+        return (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+    
+    def inc(self, name: str, value: float = 1, **labels):
+        """计数器加value"""
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+    
+    def observe(self, name: str, seconds: float, **labels):
+        """记录一次耗时"""
+        key = self._key(name, labels)
+        with self._lock:
+            timer = self._timers.get(key)
+            if timer is None:
+                timer = self._timers[key] = {
+                    'count': 0, 'sum': 0.0, 'max': 0.0, 'buckets': [0] * (len(self.BUCKETS) + 1)
+                }
+            timer['count'] += 1
+            timer['sum'] += seconds
+            timer['max'] = max(timer['max'], seconds)
+            timer['buckets'][bisect.bisect_left(self.BUCKETS, seconds)] += 1
+    
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """计时上下文，异常时同样记录"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+    
+    def total(self, name: str, **labels) -> float:
+        """计数器之和，只按给出的标签过滤"""
+        wanted = {(k, str(v)) for k, v in labels.items()}
+        with self._lock:
+            return sum(value for (counter, counter_labels), value in self._counters.items()
+                       if counter == name and wanted.issubset(counter_labels))
+    
+    def reset(self):
+        """清空所有指标"""
+        with self._lock:
+            self._counters.clear()
+            self._timers.clear()
+            self.started = time.time()
+    
+    def snapshot(self) -> Dict:
+        """JSON友好的快照"""
+        with self._lock:
+            counters = [
+                {'name': name, 'labels': dict(labels), 'value': value}
+                for (name, labels), value in sorted(self._counters.items())
+            ]
+            timers = [
+                {
+                    'name': name,
+                    'labels': dict(labels),
+                    'count': timer['count'],
+                    'sum': round(timer['sum'], 6),
+                    'avg': round(timer['sum'] / timer['count'], 6),
+                    'max': round(timer['max'], 6),
+                }
+                for (name, labels), timer in sorted(self._timers.items())
+            ]
+        return {
+            'timestamp': time.time(),
+            'uptime': round(time.time() - self.started, 1),
+            'counters': counters,
+            'timers': timers,
+        }
+    
+    @staticmethod
+    def _format_labels(labels, extra: Optional[tuple] = None) -> str:
+        pairs = list(labels) + ([extra] if extra else [])
+        if not pairs:
+            return ''
+        escaped = (
+            f'{k}="' + v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+            for k, v in pairs
+        )
+        return '{' + ','.join(escaped) + '}'
+    
+    def render_prometheus(self) -> str:
+        """Prometheus文本格式（0.0.4）"""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            timers = sorted((key, dict(timer, buckets=list(timer['buckets'])))
+                            for key, timer in self._timers.items())
+        
+        lines: List[str] = []
+        declared = set()
+        
+        def declare(name: str, kind: str):
+            if name not in declared:
+                declared.add(name)
+                lines.append(f"# HELP {name} {self.HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} {kind}")
+        
+        for (name, labels), value in counters:
+            declare(name, 'counter')
+            lines.append(f"{name}{self._format_labels(labels)} {value:g}")
+        
+        for (name, labels), timer in timers:
+            declare(name, 'histogram')
+            cumulative = 0
+            for bound, count in zip(self.BUCKETS + (float('inf'),), timer['buckets']):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else f'{bound:g}'
+                lines.append(f"{name}_bucket{self._format_labels(labels, ('le', le))} {cumulative}")
+            lines.append(f"{name}_sum{self._format_labels(labels)} {timer['sum']:.6f}")
+            lines.append(f"{name}_count{self._format_labels(labels)} {timer['count']}")
+        
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,153 @@
+"""
+播放位置持久化
+"""
+import atexit
+import bisect
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional
+
+from .text import TextProcessor
+
+# ==================== 播放管理器 ====================
+class PlaybackManager:
+    """播放状态管理器，按用户和文本内容记录位置，存放在SQLite（WAL模式）中
+    
+    每条记录单独写入，写入量与记录总数无关；多个会话和进程通过SQLite锁并发访问。
+    """
+    
+    FLUSH_INTERVAL = 2    # 写回间隔（秒），期间的多次更新合并为一次事务
+    
+    def __init__(self, db_file='playback_state.db', legacy_file='playback_state.json'):
+        self.db_file = db_file
+        self.legacy_file = legacy_file  # 旧版JSON状态文件，仅用于迁移
+        self._lock = threading.Lock()
+        self._pending: Dict[tuple, tuple] = {}
+        self._last_flush = 0.0
+        self._flush_timer = None
+        self._init_db()
+        atexit.register(self.flush)
+    
+    def _init_db(self):
+        """初始化状态数据库"""
+        self._conn = sqlite3.connect(self.db_file, timeout=30, check_same_thread=False)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS playback_positions (
+                    user TEXT,
+                    text_hash TEXT,
+                    file TEXT,
+                    chunk_index INTEGER,
+                    char_offset INTEGER,
+                    audio_offset REAL,
+                    timestamp REAL,
+                    PRIMARY KEY (user, text_hash)
+                )
+            """)
+        self._migrate_legacy_state()
+    
+    def _migrate_legacy_state(self):
+        """导入旧版playback_state.json中的分块位置记录后删除
+        
+        空文件或无法解析的文件视为没有可迁移的记录，保持原样。
+        """
+        if not os.path.exists(self.legacy_file):
+            return
+        try:
+            with open(self.legacy_file, 'r', encoding='utf-8') as f:
+                state = json.loads(f.read() or 'null')
+        except (OSError, ValueError):
+            return
+        if not isinstance(state, dict) or not state:
+            return
+        try:
+            rows = [
+                ('default', text_hash, record.get('file', ''), record.get('chunk_index', 0),
+                 record['char_offset'], record.get('audio_offset', 0.0), record.get('timestamp', 0))
+                for text_hash, record in state.items()
+                if isinstance(record, dict) and 'char_offset' in record
+            ]
+            with self._lock, self._conn:
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO playback_positions VALUES (?, ?, ?, ?, ?, ?, ?)", rows
+                )
+            os.remove(self.legacy_file)
+        except Exception as e:
+            print(f"播放状态迁移失败: {e}")
+    
+    def flush(self):
+        """批量写回待保存的位置"""
+        with self._lock:
+            if self._pending:
+                with self._conn:
+                    self._conn.executemany(
+                        "INSERT OR REPLACE INTO playback_positions VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        [key + row for key, row in self._pending.items()]
+                    )
+                self._pending.clear()
+            self._last_flush = time.time()
+            self._flush_timer = None
+    
+    def update_position(self, user: str, text_hash: str, filepath: str, chunk_index: int,
+                        char_offset: int, audio_offset: float = 0.0):
+        """更新播放位置：记录分块序号、字符偏移和块内音频偏移（秒），延迟批量写回"""
+        with self._lock:
+            self._pending[(user, text_hash)] = (
+                filepath, chunk_index, char_offset, round(audio_offset, 2), time.time()
+            )
+            if self._flush_timer is not None:
+                return
+            delay = max(0.0, self._last_flush + self.FLUSH_INTERVAL - time.time())
+            self._flush_timer = threading.Timer(delay, self.flush)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+    
+    def get_position(self, user: str, text_hash: str) -> Optional[Dict]:
+        """获取播放位置记录（优先返回尚未写回的更新）"""
+        with self._lock:
+            row = self._pending.get((user, text_hash))
+            if row is None:
+                row = self._conn.execute(
+                    "SELECT file, chunk_index, char_offset, audio_offset, timestamp "
+                    "FROM playback_positions WHERE user = ? AND text_hash = ?",
+                    (user, text_hash)
+                ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(('file', 'chunk_index', 'char_offset', 'audio_offset', 'timestamp'), row))
+    
+    def resume_point(self, user: str, text: str, max_chars: int) -> Optional[Dict]:
+        """按当前分块大小换算续播位置 {'chunk_index', 'char_offset', 'audio_offset'}"""
+        record = self.get_position(user, TextProcessor.content_hash(text))
+        spans = TextProcessor.chunk_spans(text, max_chars)
+        if not record or not spans:
+            return None
+        chunk_index = TextProcessor.chunk_at(text, record['char_offset'], max_chars)
+        # 分块边界变化后块内音频偏移不再对应，从块首开始
+        chunk_start = spans[chunk_index][0]
+        same_chunk = chunk_start == record['char_offset']
+        return {
+            'chunk_index': chunk_index,
+            'char_offset': chunk_start,
+            'audio_offset': record['audio_offset'] if same_chunk else 0.0
+        }
+    
+    def save_played(self, user: str, timeline: Dict, filepath: str, played_seconds: float) -> int:
+        """把合并音频中的播放时间换算为分块位置并保存，返回分块序号"""
+        offsets = timeline['offsets']
+        k = max(bisect.bisect_right(offsets, played_seconds) - 1, 0)
+        chunk_index = timeline['first_chunk'] + k
+        self.update_position(
+            user,
+            timeline['text_hash'],
+            filepath,
+            chunk_index,
+            timeline['char_offsets'][k],
+            max(played_seconds - offsets[k], 0.0)
+        )
+        return chunk_index
@@ -0,0 +1,80 @@
+"""
+后台预取下一章
+"""
+import concurrent.futures
+import itertools
+import os
+import threading
+from typing import Dict, List, Optional
+
+from .engines import MultiEngineTTS
+from .github import GitHubReader
+from .text import TextProcessor
+
+# ==================== 后台预取 ====================
+class Prefetcher:
+    """后台预取：下载列表中的下一个文件，并预热其前N块的TTS缓存"""
+    
+    def __init__(self, github_reader: 'GitHubReader', tts_system: MultiEngineTTS,
+                 max_download_bytes: int = 5 * 1024 * 1024, cache_headroom: float = 0.9):
+        self.github_reader = github_reader
+        self.tts_system = tts_system
+        self.max_download_bytes = max_download_bytes  # 单个文件的下载预算
+        self.cache_headroom = cache_headroom          # 缓存占用超过该比例时停止预热
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1,
+            thread_name_prefix='tts-prefetch'
+        )
+        self._scheduled = set()
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def next_file(files: List[Dict], current_path: str) -> Optional[Dict]:
+        """列表中当前文件的下一个文件"""
+        for i, file in enumerate(files[:-1]):
+            if file['path'] == current_path:
+                return files[i + 1]
+        return None
+    
+    def schedule(self, file: Dict, chunk_size: int, engine: str, max_chunks: int,
+                 lang: str = 'zh-cn') -> bool:
+        """提交预取任务，同一文件和配置只预取一次"""
+        key = (file.get('sha') or file['path'], chunk_size, engine, max_chunks)
+        with self._lock:
+            if key in self._scheduled:
+                return False
+            self._scheduled.add(key)
+        self._executor.submit(self._prefetch, key, file, chunk_size, engine, max_chunks, lang)
+        return True
+    
+    def _within_budget(self) -> bool:
+        """缓存占用是否允许继续预热"""
+        cache_manager = self.tts_system.cache_manager
+        return cache_manager.total_size() < cache_manager.max_size * self.cache_headroom
+    
+    def _prefetch(self, key: tuple, file: Dict, chunk_size: int, engine: str, max_chunks: int, lang: str):
+        try:
+            if file.get('size', 0) > self.max_download_bytes:
+                return
+            text = self.github_reader.read_file(file)
+            if not text:
+                return
+            
+            for chunk in itertools.islice(TextProcessor.iter_chunks(text, chunk_size), max_chunks):
+                if self.tts_system.cached_audio(chunk['text'], engine, lang):
+                    continue
+                if not self._within_budget():
+                    break
+                # 只使用空闲令牌（原子地预留），不与前台合成争抢
+                result = self.tts_system.synthesize_spare(chunk['text'], engine, lang)
+                if result is None:
+                    break
+                audio_path = result[0]
+                # 缓存写入失败时返回的临时文件对预取没有用处
+                if audio_path and not self.tts_system.cache_manager.owns(audio_path):
+                    os.remove(audio_path)
+        except Exception as e:
+            print(f"预取失败: {e}")
+            # 失败的预取允许之后重新提交
+            with self._lock:
+                self._scheduled.discard(key)
@@ -0,0 +1,277 @@
+"""
+分块合成调度
+"""
+import concurrent.futures
+import threading
+from queue import Queue
+from typing import Dict, List, Optional
+
+from .audio import AudioMerger
+from .engines import MultiEngineTTS
+from .text import TextProcessor
+
+# ==================== 合成调度器 ====================
+class SynthesisScheduler:
+    """分块合成调度器，使用有界工作池并保持块顺序"""
+    
+    MODES = ('thread', 'asyncio')
+    MIN_SHARED_SENTENCE = 8   # 参与句子级复用的最短句长（字），过短的句子单独合成得不偿失
+    SPLIT_COST_CHARS = 12     # 拆分多出一次请求折合的字数
+    
+    def __init__(self, tts_system: MultiEngineTTS, max_workers: int = 4, mode: str = 'thread'):
+        if mode not in self.MODES:
+            raise ValueError(f"未知的调度模式: {mode}")
+        self.tts_system = tts_system
+        self.max_workers = max(1, int(max_workers))
+        self.mode = mode
+        self.chunk_engines: Dict[int, str] = {}  # 分块序号 -> 实际使用的引擎
+        self.unique_count = 0                    # 去重后实际需要合成的分块数
+        self.reused_sentences = 0                # 句子级复用省去的合成次数
+    
+    def _synthesize(self, chunk: str, engine: Optional[str], lang: str, use_cache: bool):
+        """合成单个分块，返回 (音频路径, 实际使用的引擎)，异常视为失败"""
+        try:
+            return self.tts_system.synthesize(
+                text=chunk,
+                engine=engine,
+                lang=lang,
+                use_cache=use_cache
+            )
+        except Exception as e:
+            print(f"分块合成失败: {e}")
+            return None, None
+    
+    def engine_usage(self) -> Dict[str, int]:
+        """各引擎服务的分块数"""
+        usage: Dict[str, int] = {}
+        for used_engine in self.chunk_engines.values():
+            usage[used_engine] = usage.get(used_engine, 0) + 1
+        return usage
+    
+    def run(self, chunks: List[str], engine: Optional[str] = None, lang: str = 'zh-cn',
+            use_cache: bool = True, on_progress=None) -> List[Optional[str]]:
+        """并发合成所有分块，按原顺序返回音频路径（失败为None）
+        
+        on_progress(done, total, index, audio_path) 在调用线程中按完成顺序回调。
+        """
+        results: List[Optional[str]] = [None] * len(chunks)
+        for done, (index, result) in enumerate(
+                self.iter_completed(chunks, engine, lang, use_cache), 1):
+            results[index] = result
+            if on_progress:
+                on_progress(done, len(chunks), index, result)
+        return results
+    
+    def iter_ordered(self, chunks: List[str], engine: Optional[str] = None, lang: str = 'zh-cn',
+                     use_cache: bool = True, on_progress=None):
+        """按块顺序逐个产出 (index, audio_path)，第N块就绪即产出，后续块继续在后台合成"""
+        pending: Dict[int, Optional[str]] = {}
+        next_index = 0
+        for done, (index, result) in enumerate(
+                self.iter_completed(chunks, engine, lang, use_cache), 1):
+            pending[index] = result
+            if on_progress:
+                on_progress(done, len(chunks), index, result)
+            while next_index in pending:
+                yield next_index, pending.pop(next_index)
+                next_index += 1
+    
+    @staticmethod
+    def _split(sentences: List[str], shared: Dict[str, int]) -> List[str]:
+        """共享句单独成段，其余连续的句子合为一段"""
+        parts, run = [], ''
+        for sentence in sentences:
+            if sentence.strip() in shared:
+                if run.strip():
+                    parts.append(run.strip())
+                parts.append(sentence.strip())
+                run = ''
+            else:
+                run += sentence
+        if run.strip():
+            parts.append(run.strip())
+        return parts
+    
+    def _shared_sentences(self, sentences: Dict[int, List[str]]) -> Dict[str, int]:
+        """在给定分块中出现不止一次的整句及其出现次数"""
+        counts: Dict[str, int] = {}
+        for chunk_sentences in sentences.values():
+            for sentence in chunk_sentences:
+                key = sentence.strip()
+                if len(key) >= self.MIN_SHARED_SENTENCE:
+                    counts[key] = counts.get(key, 0) + 1
+        return {key: count for key, count in counts.items() if count > 1}
+    
+    def _plan(self, unique: List[str], engine, lang, use_cache) -> List[List[str]]:
+        """每个唯一分块的合成片段
+        
+        在本次任务中出现多次的整句单独合成一次、到处复用，其余连续的句子合为一段；分块边界不变。
+        拆分会多出请求，只有复用的字数抵得上多出的请求（每次按 SPLIT_COST_CHARS 字计）时才拆。
+        共享句只合成一次，出现n次时每处分摊 1/n 次请求，省下的是其余 n-1 次，即每处 (n-1)/n 的字数；
+        整块已有缓存的分块不拆分。
+        """
+        sentences = {u: TextProcessor.split_sentences(chunk) for u, chunk in enumerate(unique)}
+        shared = self._shared_sentences(sentences)
+        candidates = {
+            u: chunk_sentences for u, chunk_sentences in sentences.items()
+            if any(sentence.strip() in shared for sentence in chunk_sentences) and
+            not (use_cache and self.tts_system.cached_audio(unique[u], engine, lang))
+        }
+        
+        # 放弃拆分的分块不再贡献共享句，重复到方案稳定
+        while True:
+            shared = self._shared_sentences(candidates)
+            splits = {}
+            for u, chunk_sentences in candidates.items():
+                parts = self._split(chunk_sentences, shared)
+                saved = sum(len(part) * (shared[part] - 1) / shared[part] for part in parts if part in shared)
+                extra = sum(1 if part not in shared else 1 / shared[part] for part in parts) - 1
+                if saved and saved >= extra * self.SPLIT_COST_CHARS:
+                    splits[u] = parts
+            if len(splits) == len(candidates):
+                break
+            candidates = {u: sentences[u] for u in splits}
+        
+        return [splits.get(u, [chunk]) for u, chunk in enumerate(unique)]
+    
+    def _assemble(self, chunk: str, results: List[tuple], lang: str, use_cache: bool):
+        """把片段音频无间隔拼回整块，返回 (音频路径, 实际使用的引擎)
+        
+        片段全部来自同一引擎时按整块写入缓存，之后直接命中整块；任一片段失败则整块失败。
+        """
+        if len(results) == 1:
+            return results[0]
+        if any(path is None for path, _ in results):
+            return None, None
+        used_engine = results[0][1]
+        try:
+            joined = AudioMerger.concat([path for path, _ in results],
+                                        self.tts_system.cache_manager.encoder)
+        except Exception as e:
+            print(f"分块拼接失败: {e}")
+            return None, None
+        if use_cache and all(used == used_engine for _, used in results):
+            joined = self.tts_system.store(chunk, used_engine, lang, joined)
+        return joined, used_engine
+    
+    def iter_completed(self, chunks, engine, lang, use_cache):
+        """按完成顺序产出 (index, audio_path)
+        
+        分块先经过规范化，规范化后相同的分块在本次任务中只合成一次，结果复用到所有位置；
+        不同分块中重复出现的整句也只合成一次，再拼回各自的分块。
+        """
+        unique: List[str] = []
+        positions: Dict[str, List[int]] = {}
+        for i, chunk in enumerate(chunks):
+            normalized = TextProcessor.normalize_for_tts(chunk)
+            if normalized not in positions:
+                positions[normalized] = []
+                unique.append(normalized)
+            positions[normalized].append(i)
+        self.unique_count = len(unique)
+        if not unique:
+            return
+        
+        # 片段按首次出现的顺序提交，靠前的块优先合成
+        plans = self._plan(unique, engine, lang, use_cache)
+        parts: List[str] = []
+        owners: Dict[str, List[int]] = {}
+        for u, plan in enumerate(plans):
+            for part in plan:
+                if part not in owners:
+                    owners[part] = []
+                    parts.append(part)
+                if u not in owners[part]:
+                    owners[part].append(u)
+        self.reused_sentences = sum(len(plan) for plan in plans) - len(parts)
+        
+        if self.mode == 'asyncio':
+            completed = self._iter_async(parts, engine, lang, use_cache)
+        else:
+            completed = self._iter_threads(parts, engine, lang, use_cache)
+        
+        finished: Dict[str, tuple] = {}
+        try:
+            for p, result in completed:
+                finished[parts[p]] = result
+                for u in owners[parts[p]]:
+                    if any(part not in finished for part in plans[u]):
+                        continue
+                    audio_path, used_engine = self._assemble(
+                        unique[u], [finished[part] for part in plans[u]], lang, use_cache
+                    )
+                    for index in positions[unique[u]]:
+                        if used_engine:
+                            self.chunk_engines[index] = used_engine
+                        yield index, audio_path
+        finally:
+            completed.close()
+    
+    def _iter_threads(self, chunks, engine, lang, use_cache):
+        executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.max_workers,
+            thread_name_prefix='tts-worker'
+        )
+        try:
+            # 按块顺序提交，靠前的块优先进入工作池
+            futures = {
+                executor.submit(self._synthesize, chunk, engine, lang, use_cache): i
+                for i, chunk in enumerate(chunks)
+            }
+            for future in concurrent.futures.as_completed(futures):
+                yield futures[future], future.result()
+        finally:
+            # 调用方提前停止时取消尚未开始的块，并等待进行中的块结束，
+            # 避免工作线程在脚本运行结束后继续输出界面元素
+            executor.shutdown(wait=True, cancel_futures=True)
+    
+    def _iter_async(self, chunks, engine, lang, use_cache):
+        import asyncio
+        
+        completed = Queue()
+        stop = threading.Event()
+        
+        def loop_thread():
+            try:
+                asyncio.run(self._run_async(chunks, engine, lang, use_cache, completed.put, stop))
+            except Exception as e:
+                print(f"异步调度失败: {e}")
+            finally:
+                completed.put(None)
+        
+        thread = threading.Thread(target=loop_thread, name='tts-async-loop', daemon=True)
+        thread.start()
+        try:
+            while True:
+                item = completed.get()
+                if item is None:
+                    break
+                yield item
+        finally:
+            # 停止派发新块，等待进行中的块结束
+            stop.set()
+            thread.join()
+    
+    async def _run_async(self, chunks, engine, lang, use_cache, emit, stop):
+        import asyncio
+        
+        semaphore = asyncio.Semaphore(self.max_workers)
+        loop = asyncio.get_running_loop()
+        executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.max_workers,
+            thread_name_prefix='tts-async'
+        )
+        
+        async def worker(index, chunk):
+            async with semaphore:
+                if stop.is_set():
+                    return
+                result = await loop.run_in_executor(
+                    executor, self._synthesize, chunk, engine, lang, use_cache
+                )
+            emit((index, result))
+        
+        try:
+            await asyncio.gather(*(worker(i, c) for i, c in enumerate(chunks)))
+        finally:
+            executor.shutdown(wait=False)
@@ -0,0 +1,209 @@
+"""
+本地音频文件服务
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, Optional
+from urllib.parse import quote, urlparse, parse_qs
+
+from .audio import AudioEncoder
+from .metrics import Metrics
+
+# ==================== 音频文件服务 ====================
+class AudioServer:
+    """本地音频文件服务：支持Range请求，按块从磁盘读取，不把整个MP3读入内存
+    
+    返回的地址由浏览器直接访问，远程部署时需用base_url指定反向代理等可达地址。
+    同时在 /metrics（Prometheus文本）和 /metrics.json 提供流水线指标。
+    """
+    
+    BLOCK_SIZE = 64 * 1024
+    
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, base_url: str = None,
+                 metrics: Optional[Metrics] = None):
+        self.metrics = metrics or Metrics.shared()
+        self._files: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        threading.Thread(
+            target=self._server.serve_forever,
+            name='tts-audio-server',
+            daemon=True
+        ).start()
+        self.base_url = (base_url or f"http://{host}:{self._server.server_address[1]}").rstrip('/')
+    
+    def url_for(self, path: str, filename: str = None, download: bool = False) -> str:
+        """登记文件并返回其地址（地址由绝对路径决定，重跑时不变）"""
+        path = os.path.abspath(path)
+        token = hashlib.sha1(path.encode('utf-8')).hexdigest()[:16]
+        with self._lock:
+            self._files[token] = (path, filename or os.path.basename(path))
+        ext = os.path.splitext(path)[1] or '.mp3'
+        return f"{self.base_url}/audio/{token}{ext}" + ('?download=1' if download else '')
+    
+    @property
+    def metrics_url(self) -> str:
+        return f"{self.base_url}/metrics"
+    
+    def _lookup(self, token: str) -> Optional[tuple]:
+        with self._lock:
+            return self._files.get(token)
+    
+    @staticmethod
+    def _parse_range(header: str, size: int) -> Optional[tuple]:
+        """解析单段Range头，返回 (start, end)（含end）；无效时返回None"""
+        match = re.fullmatch(r'bytes=(\d*)-(\d*)', header.strip())
+        if not match or not any(match.groups()) or size == 0:
+            return None
+        first, last = match.groups()
+        if first:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+        else:
+            # 后缀形式：最后N字节
+            start, end = max(0, size - int(last)), size - 1
+        if start > end or start >= size:
+            return None
+        return start, end
+    
+    def _make_handler(self):
+        server = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            def do_HEAD(self):
+                self._serve(send_body=False)
+            
+            def do_GET(self):
+                self._serve(send_body=True)
+            
+            def _serve(self, send_body: bool):
+                url = urlparse(self.path)
+                if url.path in ('/metrics', '/metrics.json'):
+                    self._serve_metrics(url.path.endswith('.json'), send_body)
+                    return
+                
+                match = re.fullmatch(r'/audio/([0-9a-f]{16})\.\w+', url.path)
+                entry = server._lookup(match.group(1)) if match else None
+                if entry is None or not os.path.exists(entry[0]):
+                    self.send_error(404)
+                    return
+                path, filename = entry
+                size = os.path.getsize(path)
+                
+                start, end = 0, size - 1
+                status = 200
+                range_header = self.headers.get('Range')
+                if range_header:
+                    byte_range = server._parse_range(range_header, size)
+                    if byte_range is None:
+                        self.send_response(416)
+                        self.send_header('Content-Range', f'bytes */{size}')
+                        self.end_headers()
+                        return
+                    start, end = byte_range
+                    status = 206
+                
+                self.send_response(status)
+                self.send_header('Content-Type', AudioEncoder.mime_for(path))
+                self.send_header('Accept-Ranges', 'bytes')
+                self.send_header('Content-Length', str(end - start + 1))
+                self.send_header('Access-Control-Allow-Origin', '*')
+                if status == 206:
+                    self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+                if parse_qs(url.query).get('download'):
+                    self.send_header('Content-Disposition',
+                                     f"attachment; filename*=UTF-8''{quote(filename)}")
+                self.end_headers()
+                if not send_body:
+                    return
+                
+                try:
+                    with open(path, 'rb') as f:
+                        f.seek(start)
+                        remaining = end - start + 1
+                        while remaining > 0:
+                            block = f.read(min(server.BLOCK_SIZE, remaining))
+                            if not block:
+                                break
+                            self.wfile.write(block)
+                            remaining -= len(block)
+                except (BrokenPipeError, ConnectionResetError):
+                    # 浏览器拖动进度条时会中断旧请求
+                    pass
+            
+            def _serve_metrics(self, as_json: bool, send_body: bool):
+                MetricsServer.respond(self, server.metrics, as_json, send_body)
+            
+            def log_message(self, format, *args):
+                pass
+        
+        return Handler
+    
+    def player_html(self, path: str, start_time: float = 0) -> str:
+        """播放器HTML，使用媒体片段#t=从指定秒数开始"""
+        fragment = f"#t={start_time:.2f}" if start_time > 0 else ""
+        return (f'<audio controls preload="metadata" style="width:100%" '
+                f'src="{self.url_for(path)}{fragment}"></audio>')
+
+# ==================== 指标服务 ====================
+class MetricsServer:
+    """只提供 /metrics（Prometheus文本）和 /metrics.json 的本地监听，不依赖音频服务是否启用"""
+    
+    def __init__(self, host: str = '127.0.0.1', port: int = 9464, metrics: Optional[Metrics] = None):
+        self.metrics = metrics or Metrics.shared()
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        threading.Thread(
+            target=self._server.serve_forever,
+            name='tts-metrics-server',
+            daemon=True
+        ).start()
+        self.base_url = f"http://{host}:{self._server.server_address[1]}"
+    
+    @property
+    def metrics_url(self) -> str:
+        return f"{self.base_url}/metrics"
+    
+    @staticmethod
+    def respond(handler: BaseHTTPRequestHandler, metrics: Metrics, as_json: bool, send_body: bool):
+        """写出指标响应，音频服务和指标服务共用"""
+        if as_json:
+            body = json.dumps(metrics.snapshot(), ensure_ascii=False).encode('utf-8')
+            content_type = 'application/json; charset=utf-8'
+        else:
+            body = metrics.render_prometheus().encode('utf-8')
+            content_type = 'text/plain; version=0.0.4; charset=utf-8'
+        handler.send_response(200)
+        handler.send_header('Content-Type', content_type)
+        handler.send_header('Content-Length', str(len(body)))
+        handler.send_header('Cache-Control', 'no-store')
+        handler.end_headers()
+        if send_body:
+            handler.wfile.write(body)
+    
+    def _make_handler(self):
+        server = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            def do_HEAD(self):
+                self._serve(send_body=False)
+            
+            def do_GET(self):
+                self._serve(send_body=True)
+            
+            def _serve(self, send_body: bool):
+                path = urlparse(self.path).path
+                if path not in ('/metrics', '/metrics.json'):
+                    self.send_error(404)
+                    return
+                MetricsServer.respond(self, server.metrics, path.endswith('.json'), send_body)
+            
+            def log_message(self, format, *args):
+                pass
+        
+        return Handler
@@ -0,0 +1,191 @@
+"""
+文本解码、规范化与分块
+"""
+import bisect
+import hashlib
+import re
+import threading
+import unicodedata
+import zlib
+from collections import OrderedDict
+from typing import List
+
+from .metrics import Metrics
+
+# ==================== 文本处理器 ====================
+class TextProcessor:
+    """智能文本处理器"""
+    
+    SENTENCE_END = re.compile(r'[。！？；.!?;]')
+    # 复用判断用的整句：句末标点连同其后的右引号、右括号
+    SENTENCE = re.compile(r'.+?(?:[。！？；.!?;]+[”’」』）)"\']*|$)', re.S)
+    PARAGRAPH_BREAK = re.compile(r'\n\n')
+    # 不可见字符：零宽字符、BOM、软连字符、双向控制符
+    INVISIBLE_CHARS = re.compile('[\u00ad\u180e\u200b-\u200f\u202a-\u202e\u2060-\u2064\ufeff]')
+    # 中日韩字符及其标点之间的空格对朗读没有意义
+    CJK_GAP = re.compile(r'(?<=[\u3000-\u303f\u4e00-\u9fff\uff00-\uffef]) (?=[\u3000-\u303f\u4e00-\u9fff\uff00-\uffef])')
+    
+    ANCHOR_DIVISOR = 4  # 约四分之一的句子可作为锚点
+    MEMO_SIZE = 8       # 记忆最近几篇文本的分块结果
+    
+    _memo: 'OrderedDict[tuple, tuple]' = OrderedDict()
+    _memo_lock = threading.Lock()
+    
+    @staticmethod
+    def decode_bytes(data: bytes) -> str:
+        """识别中文文本编码：UTF-8（含BOM）、GB18030（兼容GBK/GB2312），其余交给charset_normalizer"""
+        for encoding in ('utf-8-sig', 'gb18030'):
+            try:
+                return data.decode(encoding)
+            except UnicodeDecodeError:
+                continue
+        try:
+            from charset_normalizer import from_bytes
+            best = from_bytes(data).best()
+            if best is not None:
+                return str(best)
+        except ImportError:
+            pass
+        return data.decode('utf-8', errors='replace')
+    
+    @classmethod
+    def normalize_for_tts(cls, text: str) -> str:
+        """合成前的文本规范化
+        
+        NFKC统一全角/半角字符和标点，去除不可见字符，空白合并为单个空格，
+        并删除中文字符之间多余的空格。
+        """
+        text = unicodedata.normalize('NFKC', text)
+        text = cls.INVISIBLE_CHARS.sub('', text)
+        text = ' '.join(text.split())
+        return cls.CJK_GAP.sub('', text)
+    
+    @classmethod
+    def split_sentences(cls, text: str) -> List[str]:
+        """把文本切成整句，各句首尾相接恰好还原原文（只用于句子级复用，不影响分块）"""
+        return [match.group() for match in cls.SENTENCE.finditer(text) if match.group()]
+    
+    @classmethod
+    def _sentence_spans(cls, text: str, start: int, end: int):
+        """按句末标点切分区间"""
+        pos = start
+        for match in cls.SENTENCE_END.finditer(text, start, end):
+            yield pos, match.end()
+            pos = match.end()
+        if pos < end:
+            yield pos, end
+    
+    @classmethod
+    def _unit_spans(cls, text: str):
+        """句子单元 (start, end, 是否段落结尾)"""
+        pos = 0
+        while True:
+            match = cls.PARAGRAPH_BREAK.search(text, pos)
+            end = match.start() if match else len(text)
+            last = None
+            for span in cls._sentence_spans(text, pos, end):
+                if last:
+                    yield last[0], last[1], False
+                last = span
+            if last:
+                yield last[0], last[1], True
+            if match is None:
+                break
+            pos = match.end()
+    
+    @classmethod
+    def _is_anchor(cls, text: str, start: int, end: int) -> bool:
+        """由句子内容哈希决定的候选边界，与句子所在位置无关"""
+        sentence = text[start:end].strip().encode('utf-8')
+        return zlib.crc32(sentence) % cls.ANCHOR_DIVISOR == 0
+    
+    @classmethod
+    def _anchored_spans(cls, text: str, max_chars: int):
+        """内容定义的分块边界
+        
+        块长度达到 max_chars 一半后，在段落结尾或锚点句之后切分；超过 max_chars 时强制切分。
+        边界只取决于附近句子的内容，修改某一段只影响其附近的块，之后的边界会重新对齐。
+        """
+        min_chars = max_chars // 2
+        cur_start = cur_end = None
+        for start, end, paragraph_end in cls._unit_spans(text):
+            if cur_start is not None and end - cur_start > max_chars:
+                yield cur_start, cur_end
+                cur_start = None
+            if cur_start is None:
+                cur_start = start
+            cur_end = end
+            if end - cur_start >= min_chars and (paragraph_end or cls._is_anchor(text, start, end)):
+                yield cur_start, cur_end
+                cur_start = None
+        if cur_start is not None:
+            yield cur_start, cur_end
+    
+    @classmethod
+    def iter_chunks(cls, text: str, max_chars: int = 400):
+        """惰性产出分块记录 {'index', 'start', 'end', 'text'}，偏移量指向原文
+        
+        单次线性扫描，不拼接字符串；段落之间保留原文分隔符。
+        """
+        if not text:
+            return
+        
+        index = 0
+        for start, end in cls._anchored_spans(text, max_chars):
+            # 去掉首尾空白，跳过空块
+            while start < end and text[start].isspace():
+                start += 1
+            while end > start and text[end - 1].isspace():
+                end -= 1
+            if start < end:
+                yield {'index': index, 'start': start, 'end': end, 'text': text[start:end]}
+                index += 1
+    
+    @classmethod
+    def chunk_spans(cls, text: str, max_chars: int = 400) -> tuple:
+        """分块的 (start, end) 偏移，按 (文本哈希, 分块大小) 记忆"""
+        key = (hashlib.sha1(text.encode('utf-8')).hexdigest(), max_chars)
+        metrics = Metrics.shared()
+        with cls._memo_lock:
+            if key in cls._memo:
+                cls._memo.move_to_end(key)
+                metrics.inc('tts_chunking_memo_hits_total')
+                return cls._memo[key]
+        
+        with metrics.timer('tts_chunking_seconds'):
+            spans = tuple((c['start'], c['end']) for c in cls.iter_chunks(text, max_chars))
+        metrics.inc('tts_chunks_total', len(spans))
+        with cls._memo_lock:
+            cls._memo[key] = spans
+            while len(cls._memo) > cls.MEMO_SIZE:
+                cls._memo.popitem(last=False)
+        return spans
+    
+    @classmethod
+    def smart_chunk(cls, text: str, max_chars: int = 400) -> List[str]:
+        """智能分块文本"""
+        return [text[start:end] for start, end in cls.chunk_spans(text, max_chars)]
+    
+    @classmethod
+    def count_chunks(cls, text: str, max_chars: int = 400) -> int:
+        """分块数量（使用记忆结果）"""
+        return len(cls.chunk_spans(text, max_chars))
+    
+    @staticmethod
+    def content_hash(text: str) -> str:
+        """文本内容哈希，用作续播记录的稳定键（与文件名、路径无关）"""
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+    
+    @classmethod
+    def chunk_at(cls, text: str, char_offset: int, max_chars: int = 400) -> int:
+        """包含给定字符偏移的分块序号（分块大小变化后仍能定位）"""
+        spans = cls.chunk_spans(text, max_chars)
+        if not spans:
+            return 0
+        index = bisect.bisect_right([start for start, _ in spans], char_offset) - 1
+        return min(max(index, 0), len(spans) - 1)
+    
+    @staticmethod
+    def estimate_tts_time(text: str, chars_per_second: int = 15) -> float:
+        """估计TTS生成时间"""
+        return len(text) / chars_per_second